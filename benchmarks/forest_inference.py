@@ -0,0 +1,99 @@
+"""Benchmark ForestEngine against RandomForestClassifier.predict on a synthetic image"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from segmentation.features import ScaleSpace, compute_features
+from segmentation.inference import ForestEngine
+
+FEATURES = ["Gaussian Smoothing", "Edge", "Laplacian of Gaussian", "Gaussian Gradient Magnitude",
+            "Difference of Gaussians", "Structure Tensor Eigenvalues", "Hessian of Gaussian Eigenvalue"]
+
+
+def synthetic_cells(size, seed=0):
+    """Grayscale-in-RGB image of bright discs on a noisy background, with its true labels"""
+    rng = np.random.default_rng(seed)
+    truth = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(size * size // 4000):
+        cy, cx, r = rng.integers(0, size, 2).tolist() + [int(rng.integers(6, 20))]
+        cv2.circle(truth, (cx, cy), r, 1, -1)
+    gray = np.clip(40 + 140 * truth + rng.normal(0, 25, truth.shape), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB), truth + 1
+
+
+def best_of(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def compare_engine(title, classifier, X, workers, repeats):
+    """Time ForestEngine against the classifier on X and check that the results are identical"""
+    start = time.perf_counter()
+    engine = ForestEngine(classifier)
+    export_time = time.perf_counter() - start
+
+    sklearn_time, expected = best_of(lambda: classifier.predict(X), repeats)
+    sklearn_proba_time, expected_proba = best_of(lambda: classifier.predict_proba(X), repeats)
+    engine_time, labels = best_of(lambda: engine.predict(X), repeats)
+    threaded_time, threaded_labels = best_of(lambda: engine.predict(X, workers), repeats)
+    proba = engine.predict_proba(X, workers)
+
+    print(f"{title}: {len(X)} rows, {X.shape[1]} features, {sum(tree.node_count for tree in engine.trees)} nodes, "
+          f"{engine.chunk_rows}-row chunks, export {export_time * 1000:.1f} ms")
+    print(f"{'classifier.predict':<26}{sklearn_time:8.3f} s")
+    print(f"{'classifier.predict_proba':<26}{sklearn_proba_time:8.3f} s")
+    print(f"{'engine, 1 thread':<26}{engine_time:8.3f} s  ({sklearn_time / engine_time:.2f}x)")
+    print(f"{f'engine, {workers} threads':<26}{threaded_time:8.3f} s  ({sklearn_time / threaded_time:.2f}x)")
+    print(f"identical labels: {np.array_equal(labels, expected) and np.array_equal(threaded_labels, expected)}, "
+          f"identical probabilities: {np.array_equal(proba, expected_proba)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--train-pixels", type=int, default=20000)
+    parser.add_argument("--deep-train-pixels", type=int, default=200000,
+                        help="training pixels of the deep forest case, 0 to skip it")
+    parser.add_argument("--label-noise", type=float, default=0.1,
+                        help="fraction of flipped labels that makes the deep forest grow deep")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    img, truth = synthetic_cells(args.size)
+    config = {"features": FEATURES, "sigmas": [0.3, 0.7, 1.0, 1.6, 3.5, 5.0, 10.0]}
+    stack = compute_features(ScaleSpace(img, cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)), config)
+    X = stack.pixels()
+
+    rng = np.random.default_rng(1)
+    train = rng.choice(len(X), size=min(args.train_pixels, len(X)), replace=False)
+    classifier = RandomForestClassifier(n_estimators=100, random_state=42)
+    classifier.fit(X[train], truth.ravel()[train])
+    compare_engine(f"{args.size}x{args.size}, small forest", classifier, X, args.workers, args.repeats)
+
+    if args.deep_train_pixels:
+        # Noisy labels on many pixels grow full-depth trees, like forests trained on dense real labels
+        labels = truth.ravel().copy()
+        flipped = rng.random(len(labels)) < args.label_noise
+        labels[flipped] = 3 - labels[flipped]
+        train = rng.choice(len(X), size=min(args.deep_train_pixels, len(X)), replace=False)
+        classifier = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
+        classifier.fit(X[train], labels[train])
+        classifier.n_jobs = None
+        print()
+        compare_engine(f"{args.size}x{args.size}, deep forest", classifier, X, args.workers, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
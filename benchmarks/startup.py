@@ -0,0 +1,111 @@
+"""Startup benchmark: how long fresh processes take to get going, and which heavy modules they import.
+
+Each scenario runs in a new interpreter, the way a spawned batch worker, a server or a
+command-line run starts, and is timed from process launch to exit. The "eager" scenario
+imports what every process importing gui.py used to load at startup, before the core
+moved into the segmentation package:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeats 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from segmentation.config import feature_config
+from segmentation.io import save_model
+from segmentation.training import train_forest
+
+HEAVY_MODULES = ["tkinter", "PIL.ImageTk", "cv2", "scipy.ndimage", "skimage", "sklearn"]
+
+# A config that needs only SciPy filters, as a pruned or Gaussian-only model would
+WORKER_CONFIG = feature_config(["Gaussian Smoothing", "Gaussian Gradient Magnitude", "Difference of Gaussians"])
+
+SCENARIOS = {
+    "eager": "import cv2, tkinter, PIL.ImageTk, scipy.ndimage, skimage.feature, skimage.filters, skimage.util, "
+             "sklearn.ensemble",
+    "gui": "import gui",
+    "core": "import segmentation",
+    "server": "import server",
+    "cli": "import segment",
+    "worker": "from segmentation.pipeline import init_batch_worker, segment_batch_item",
+    "worker_segment": """
+import numpy as np
+from segmentation.config import batch_options
+from segmentation.io import load_model
+from segmentation.pipeline import init_batch_worker, segment_batch_item
+classifier, config = load_model(MODEL)
+init_batch_worker(classifier, config, batch_options(None))
+result = segment_batch_item("probe", np.zeros((64, 64, 3), dtype=np.uint8))
+assert "error" not in result, result
+""",
+}
+
+CHILD = """
+import json, sys
+sys.path.insert(0, {root!r})
+MODEL = {model!r}
+{code}
+print(json.dumps([name for name in {heavy!r} if name in sys.modules]))
+"""
+
+
+def write_probe_model(path):
+    """Save a tiny forest over WORKER_CONFIG channels for the worker scenarios"""
+    rng = np.random.default_rng(0)
+    channels = 3 * len(WORKER_CONFIG["sigmas"]) - 1
+    features = rng.normal(size=(200, channels)).astype(np.float32)
+    labels = (features[:, 0] > 0).astype(np.uint8) + 1
+    save_model(path, train_forest(features, labels, n_estimators=10), WORKER_CONFIG)
+
+
+def run_scenario(code, model, repeats):
+    """Launch a fresh interpreter repeats times, returning the wall times and the heavy modules it loaded"""
+    script = CHILD.format(root=ROOT, model=model, code=code, heavy=HEAVY_MODULES)
+    seconds = []
+    loaded = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout
+        seconds.append(time.perf_counter() - start)
+        loaded = json.loads(output.strip().splitlines()[-1])
+    return seconds, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure process startup time and heavy imports per entry point")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--only", nargs="+", choices=sorted(SCENARIOS), help="Run only these scenarios")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        model = os.path.join(folder, "probe.pkl")
+        write_probe_model(model)
+        for name, code in SCENARIOS.items():
+            if args.only and name not in args.only:
+                continue
+            seconds, loaded = run_scenario(code, model, args.repeats)
+            results[name] = {"median_seconds": statistics.median(seconds), "min_seconds": min(seconds),
+                             "heavy_modules": loaded}
+            print(f"{name:<16}{statistics.median(seconds):8.3f} s   {', '.join(loaded) or '-'}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"repeats": args.repeats, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""Headless benchmark suite for feature extraction, training, segmentation, display and video.
+
+Runs on synthetic cell-like images (512x512 to 4096x4096 by default) and synthetic
+time-lapse videos, recording wall time, peak RSS and pixels/s per case into a JSON file.
+A later run can be compared against that baseline, flagging cases that got slower or
+used more memory than the tolerances allow:
+
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --compare baseline.json
+    python benchmarks/suite.py --compare baseline.json --against other.json
+
+display_preview and paint_label are measured through the app's own rendering and brush
+code on a view object without a Tk root, so they exclude the final Tk photo copy; they
+are skipped where tkinter or PIL is not installed. Peak RSS is recorded as the growth
+over the RSS at the start of each case, so it does not depend on the cases run before.
+Compare mode exits with status 1 when a regression is found.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from forest_inference import FEATURES, synthetic_cells
+try:
+    from gui import AdvancedSegmentationApp
+except ImportError:
+    # No tkinter or PIL on this machine: the display cases are skipped
+    AdvancedSegmentationApp = None
+from segmentation.config import FEATURE_FAMILIES
+from segmentation.features import (FeatureCache, ScaleSpace, compute_features, feature_jobs, image_features,
+                                   region_features)
+from segmentation.inference import TemporalSegmenter, coarse_to_fine_labels, predict_labels
+from segmentation.io import VideoFrameStore, iter_video_frames
+from segmentation.training import TrainingSet, make_classifier, train_forest
+
+SIGMAS = [0.3, 0.7, 1.0, 1.6, 3.5, 5.0, 10.0]
+CONFIG = {"features": FEATURES, "sigmas": SIGMAS}
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakRss:
+    """Sample the resident set size on a background thread while a case runs.
+
+    peak ends up as the highest RSS seen minus the RSS when the case started.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = current_rss()
+        if self.start is None:
+            self.start = self._max_rss()
+        self.peak = self.start
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss() or 0)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        rss = current_rss()
+        if rss is None:
+            # No /proc: fall back to how far the process-wide high-water mark moved
+            self.peak = self._max_rss()
+        else:
+            self.peak = max(self.peak, rss)
+        self.peak = max(0, self.peak - self.start)
+
+    @staticmethod
+    def _max_rss():
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class Suite:
+    """Runs named cases and collects their measurements"""
+
+    def __init__(self, repeats=1, only=None):
+        self.repeats = repeats
+        self.only = re.compile(only) if only else None
+        self.results = {}
+
+    def wants(self, name):
+        return self.only is None or self.only.search(name) is not None
+
+    def run(self, name, pixels, fn, setup=None):
+        """Time fn() (after an untimed setup() per repeat), keeping the fastest repeat"""
+        if not self.wants(name):
+            return
+        best = None
+        for _ in range(self.repeats):
+            state = setup() if setup is not None else None
+            with PeakRss() as rss:
+                start = time.perf_counter()
+                fn() if setup is None else fn(state)
+                seconds = time.perf_counter() - start
+            if best is None or seconds < best["seconds"]:
+                best = {"seconds": seconds, "peak_rss_mb": rss.peak / 1024 ** 2}
+        best["pixels"] = int(pixels)
+        best["pixels_per_second"] = pixels / best["seconds"] if best["seconds"] > 0 else float("inf")
+        self.results[name] = best
+        print(f"{name:<56}{best['seconds']:9.3f} s {best['peak_rss_mb']:9.0f} MB "
+              f"{best['pixels_per_second']:12.4g} px/s", flush=True)
+
+
+def synthetic_scribbles(truth, strokes, radius=3, seed=0):
+    """Label mask of small disks stamped with the true label, like sparse user scribbles"""
+    rng = np.random.default_rng(seed)
+    mask = np.zeros_like(truth)
+    height, width = truth.shape
+    for y, x in zip(rng.integers(0, height, strokes), rng.integers(0, width, strokes)):
+        cv2.circle(mask, (int(x), int(y)), radius, int(truth[y, x]), -1)
+    return mask
+
+
+def synthetic_video(path, size, frames, seed=0):
+    """Write an MJPG time-lapse of slowly drifting bright discs on a static noisy background.
+
+    Returns the true labels of the first frame.
+    """
+    rng = np.random.default_rng(seed)
+    count = size * size // 4000
+    centers = rng.uniform(0, size, (count, 2))
+    velocities = rng.normal(0, 0.5, (count, 2)) * (rng.random((count, 1)) < 0.2)
+    radii = rng.integers(6, 20, count)
+    background = rng.normal(0, 25, (size, size))
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (size, size))
+    first = None
+    try:
+        for t in range(frames):
+            truth = np.zeros((size, size), dtype=np.uint8)
+            for (y, x), r in zip(centers + t * velocities, radii):
+                cv2.circle(truth, (int(x), int(y)), int(r), 1, -1)
+            gray = np.clip(40 + 140 * truth + background, 0, 255).astype(np.uint8)
+            writer.write(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+            if first is None:
+                first = truth + 1
+    finally:
+        writer.release()
+    return first
+
+
+if AdvancedSegmentationApp is not None:
+    class HeadlessView(AdvancedSegmentationApp):
+        """The app's compositing, zoom rendering and brush code without a Tk root"""
+
+        def __init__(self, img, zoom_level=1.0):
+            self.current_image = img
+            self.img_height, self.img_width = img.shape[:2]
+            self.label_mask = np.zeros(img.shape[:2], dtype=np.uint8)
+            self.live_labels = None
+            self.label_colors = {1: (255, 0, 0), 2: (0, 255, 0)}
+            self.composite_cache = None
+            self.composite_sources = ()
+            self.brush_stencils = {}
+            self.zoom_level = zoom_level
+
+
+def feature_cases(suite, img, size):
+    """One case per feature family and sigma, each on a fresh scale space"""
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    probe = ScaleSpace(img[:1, :1], gray[:1, :1])
+    for family in FEATURE_FAMILIES:
+        for names, _ in feature_jobs(probe, {"features": [family], "sigmas": SIGMAS}):
+            index = int(names[0].rsplit("_", 1)[1])
+            if len(names) > 1:
+                label = "all"
+            elif family == "Difference of Gaussians":
+                label = f"sigma={SIGMAS[index]}-{SIGMAS[index + 1]}"
+            else:
+                label = f"sigma={SIGMAS[index]}"
+            config = {"features": [family], "sigmas": SIGMAS, "channels": names}
+            suite.run(f"features/{family}/{label}/{size}", size * size,
+                      lambda state, config=config: compute_features(state, config),
+                      setup=lambda: ScaleSpace(img, gray))
+
+
+def image_cases(suite, size, workers):
+    img, truth = synthetic_cells(size)
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    pixels = size * size
+
+    feature_cases(suite, img, size)
+
+    suite.run(f"features/all/{size}", pixels, lambda: compute_features(ScaleSpace(img, gray), CONFIG, workers))
+
+    # Scribbles covering roughly 1% of the image, trained the way the app does
+    scribbles = synthetic_scribbles(truth, max(50, pixels // 3000))
+    classifier = make_classifier()
+
+    def train():
+        training_set = TrainingSet(CONFIG, max_rows_per_label=20000)
+        training_set.update(FeatureCache.make_key(img, None), scribbles,
+                            lambda region: region_features(img, CONFIG, region, workers))
+        classifier.fit(training_set.features[:training_set.size], training_set.labels[:training_set.size])
+
+    labeled = int(np.count_nonzero(scribbles))
+    suite.run(f"train/{size}", labeled, train)
+    if not hasattr(classifier, "estimators_"):
+        train()
+
+    if suite.wants(f"segment/predict/{size}"):
+        stack = compute_features(ScaleSpace(img, gray), CONFIG, workers)
+        suite.run(f"segment/predict/{size}", pixels, lambda: predict_labels(classifier, stack, workers=workers))
+        del stack
+    suite.run(f"segment/full/{size}", pixels,
+              lambda: predict_labels(classifier, compute_features(ScaleSpace(img, gray), CONFIG, workers),
+                                     workers=workers))
+    suite.run(f"segment/coarse_to_fine/{size}", pixels,
+              lambda: coarse_to_fine_labels(classifier, img, CONFIG, workers=workers))
+
+    if AdvancedSegmentationApp is None:
+        return
+
+    # A full display refresh renders a 1280x800 viewport from a fresh composite
+    for zoom in (1.0, 0.5):
+        def render(view):
+            zoom_width, zoom_height = view._display_size()
+            view._render_display_rect(0, 0, min(1280, zoom_width), min(800, zoom_height))
+        suite.run(f"display_preview/zoom={zoom}/{size}", min(1280 * 800, pixels * zoom * zoom), render,
+                  setup=lambda zoom=zoom: HeadlessView(img, zoom))
+
+    # A brush stroke of 200 motion events, each stamped, blended and re-rendered like paint_label
+    def paint(view):
+        view._composite()
+        for i in range(200):
+            x = int(size * (0.1 + 0.8 * i / 200))
+            y0, y1, x0, x1 = view.stamp_brush([(x, size // 2)], 10, 1)
+            view._composite()[y0:y1, x0:x1] = view._blend_region(y0, y1, x0, x1)
+            view._render_display_rect(x0, y0, x1, y1)
+    suite.run(f"paint_label/{size}", 200, paint, setup=lambda: HeadlessView(img))
+
+
+def video_cases(suite, size, frames, workers):
+    path = os.path.join(tempfile.mkdtemp(), f"synthetic_{size}.avi")
+    truth = synthetic_video(path, size, frames)
+    pixels = size * size * frames
+
+    try:
+        suite.run(f"video/decode/{size}", pixels, lambda: sum(1 for _ in iter_video_frames(path)))
+
+        def random_access():
+            store = VideoFrameStore(path)
+            try:
+                for index in np.random.default_rng(0).permutation(len(store)):
+                    store.frame(int(index))
+            finally:
+                store.close()
+        suite.run(f"video/random_access/{size}", pixels, random_access)
+
+        first = cv2.cvtColor(next(iter_video_frames(path))[1], cv2.COLOR_BGR2RGB)
+        training_set = TrainingSet(CONFIG, max_rows_per_label=20000)
+        training_set.update("first", synthetic_scribbles(truth, max(50, size * size // 3000)),
+                            lambda region: region_features(first, CONFIG, region, workers))
+        classifier = train_forest(training_set.features[:training_set.size], training_set.labels[:training_set.size])
+
+        def per_frame():
+            for _, frame in iter_video_frames(path):
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                predict_labels(classifier, image_features(rgb, CONFIG, workers), workers=workers)
+
+        def temporal():
+            segmenter = TemporalSegmenter(classifier, CONFIG, workers=workers)
+            for _, frame in iter_video_frames(path):
+                segmenter.segment(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+        suite.run(f"video/segment_full/{size}", pixels, per_frame)
+        suite.run(f"video/segment_temporal/{size}", pixels, temporal)
+    finally:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+def compare(baseline, current, tolerance, memory_tolerance, min_seconds=0.005, min_megabytes=16):
+    """Print per-case ratios against a baseline and return the names of regressed cases.
+
+    Differences below min_seconds or min_megabytes are treated as noise.
+    """
+    regressions = []
+    print(f"{'case':<56}{'time':>10}{'memory':>10}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<56}{'new':>10}")
+            continue
+        time_ratio = result["seconds"] / base["seconds"] if base["seconds"] > 0 else 1.0
+        memory_ratio = result["peak_rss_mb"] / base["peak_rss_mb"] if base["peak_rss_mb"] > 0 else 1.0
+        slower = time_ratio > 1 + tolerance and result["seconds"] - base["seconds"] > min_seconds
+        larger = memory_ratio > 1 + memory_tolerance and result["peak_rss_mb"] - base["peak_rss_mb"] > min_megabytes
+        flag = "  REGRESSION" if slower or larger else ""
+        print(f"{name:<56}{time_ratio:9.2f}x{memory_ratio:9.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    missing = set(baseline["results"]) - set(current["results"])
+    if missing:
+        print(f"{len(missing)} baseline case(s) not run")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark feature extraction, training, segmentation, "
+                                                 "display and video processing")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048, 4096])
+    parser.add_argument("--video-sizes", type=int, nargs="*", default=[512, 1024])
+    parser.add_argument("--video-frames", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--only", help="Run only cases whose name matches this regular expression")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare the results against")
+    parser.add_argument("--against", help="Compare this results file with the baseline instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown")
+    parser.add_argument("--memory-tolerance", type=float, default=0.20, help="Allowed relative peak RSS growth")
+    args = parser.parse_args()
+
+    if args.against:
+        with open(args.against) as f:
+            current = json.load(f)
+    else:
+        suite = Suite(args.repeats, args.only)
+        if AdvancedSegmentationApp is None:
+            print("tkinter or PIL is not installed, skipping the display_preview and paint_label cases")
+        for size in args.sizes:
+            image_cases(suite, size, args.workers)
+        for size in args.video_sizes:
+            video_cases(suite, size, args.video_frames, args.workers)
+        current = {
+            "meta": {
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "opencv": cv2.__version__,
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "workers": args.workers,
+                "repeats": args.repeats,
+            },
+            "results": suite.results,
+        }
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.tolerance, args.memory_tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,17 +6,22 @@ from tkinter import ttk, filedialog, messagebox, simpledialog
 from PIL import Image, ImageTk, ImageEnhance, ImageFilter
 import logging
 from datetime import datetime
-from skimage.feature import hessian_matrix, hessian_matrix_eigvals
-from skimage.filters import gabor, gaussian, laplace, sobel
-from sklearn.ensemble import RandomForestClassifier
 import re
 import shutil
-from glob import glob
 import colorsys
 from collections import OrderedDict
 import threading
 import queue
 import time
+from segmentation import metrics
+from segmentation.config import DEFAULT_SIGMAS, FEATURE_FAMILIES, OUTPUT_EXTENSIONS, batch_options, feature_config
+from segmentation.features import (FeatureCache, ScaleSpace, coarse_features, compute_features, feature_jobs,
+                                   image_features, rank_channels, region_features)
+from segmentation.inference import (coarse_to_fine_labels, describe_levels, forest_engine, labels_to_binary,
+                                    predict_labels)
+from segmentation.io import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, VideoFrameStore, batch_source, segmented_path
+from segmentation.pipeline import run_batch
+from segmentation.training import TrainingSet, train_forest
 
 
 class EnhancedScrollFrame(ttk.Frame):
@@ -71,6 +76,122 @@ class EnhancedScrollFrame(ttk.Frame):
         self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
 
 
+def fit_size(width, height, box_width, box_height):
+    """Largest size with the aspect ratio of width x height that fits inside the box"""
+    if width / height > box_width / box_height:
+        return box_width, max(1, int(box_width * height / width))
+    return max(1, int(box_height * width / height)), box_height
+
+
+class ProxyCache:
+    """Background-built cache of display-sized frame proxies.
+
+    load_frame(index) returns a full-resolution RGB frame. Proxies are downscaled to fit
+    the display size and kept in a memory-capped LRU. request() reads ahead in the
+    playback direction on a background thread; a newer request supersedes the old one.
+    """
+
+    def __init__(self, load_frame, count, max_bytes=256 * 1024 ** 2, read_ahead=24):
+        self.load_frame = load_frame
+        self.count = count
+        self.max_bytes = max_bytes
+        self.read_ahead = read_ahead
+        self.size = None
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self._request = None
+        self._request_ready = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._read_ahead_loop, daemon=True)
+        self._thread.start()
+
+    def resize(self, size):
+        """Set the display size, dropping proxies built for another size"""
+        with self._lock:
+            if size != self.size:
+                self.size = size
+                self._cache.clear()
+                self._cache_bytes = 0
+
+    def _build(self, index, size):
+        img = Image.fromarray(self.load_frame(index))
+        if size is not None:
+            img = img.resize(fit_size(img.width, img.height, *size), Image.LANCZOS)
+        return img
+
+    def _put(self, index, size, img):
+        with self._lock:
+            if size != self.size or index in self._cache:
+                return
+            self._cache[index] = img
+            self._cache_bytes += img.width * img.height * len(img.getbands())
+            while self._cache_bytes > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def get(self, index, build=False):
+        """Return the proxy for index, building it now if build is set and it is missing"""
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return self._cache[index]
+            size = self.size
+        if not build:
+            return None
+        img = self._build(index, size)
+        self._put(index, size, img)
+        return img
+
+    def newest_ready(self, start, stop):
+        """Highest index in [start, stop] whose proxy is ready, or None"""
+        with self._lock:
+            for index in range(stop, start - 1, -1):
+                if index in self._cache:
+                    return index
+        return None
+
+    def request(self, index, direction=1):
+        """Build proxies from index onwards in direction on the background thread"""
+        with self._request_ready:
+            self._request = (index, direction)
+            self._request_ready.notify()
+
+    def _read_ahead_loop(self):
+        while True:
+            with self._request_ready:
+                while self._request is None and not self._closed:
+                    self._request_ready.wait()
+                if self._closed:
+                    return
+                index, direction = self._request
+                self._request = None
+
+            for step in range(self.read_ahead + 1):
+                target = index + direction * step
+                if self._request is not None or self._closed or not 0 <= target < self.count:
+                    break
+                with self._lock:
+                    size = self.size
+                    cached = target in self._cache
+                if cached:
+                    continue
+                try:
+                    self._put(target, size, self._build(target, size))
+                except Exception as e:
+                    logging.error(f"Proxy build failed: {str(e)}")
+                    break
+
+    def close(self):
+        """Stop the background thread and drop all proxies"""
+        with self._request_ready:
+            self._closed = True
+            self._request_ready.notify()
+        self._thread.join()
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+
 class AdvancedSegmentationApp:
     def _init_(self, root):
         self.root = root
@@ -139,6 +260,22 @@ class AdvancedSegmentationApp:
 
         # Processing variables
         self.classifier = None
+        self.training_data = None
+        self.training_labels = None
+        self.training_set = None
+        self.scale_space = None
+        self.prediction_block_rows = 256
+        self.prediction_workers = os.cpu_count() or 1
+        self.feature_workers = os.cpu_count() or 1
+        self.feature_cache = FeatureCache("feature_cache", max_bytes=2 * 1024 ** 3)
+        metrics.registry.add_collector(self.feature_cache.collect_metrics)
+        self.feature_channels = None
+        self.pruned_selection = None
+        self.feature_change_after_id = None
+        self.prune_kept_importance = 0.95
+        self.max_training_rows_per_label = 20000
+        self.coarse_to_fine_tolerance = 0.01
+        self.temporal_threshold = 8
         self.feature_params = {}
         self.zoom_level = 1.0
         self.crop_coords = None
@@ -149,11 +286,36 @@ class AdvancedSegmentationApp:
         self.current_tool = "brush"
         self.last_x = None
         self.last_y = None
+        self.brush_stencils = {}
+        self.viewport = None
+        self.render_pending = False
+        self.composite_cache = None
+        self.composite_sources = ()
+
+        # Live update
+        self.live_update_delay_ms = 400
+        self.live_proxy_size = 512
+        self.live_generation = 0
+        self.live_after_id = None
+        self.live_poll_id = None
+        self.live_results = queue.Queue()
+        self.live_labels = None
+        self.training_lock = threading.Lock()
+
+        # Colony growth preview
+        self.colony_preview_playing = False
+        self.colony_playback_fps = 5
+        self.colony_play_id = None
+        self.colony_proxies = None
+        self.colony_idx = 0
+        self.colony_direction = 1
 
         # Batch processing
         self.batch_queue = queue.Queue()
         self.batch_running = False
         self.batch_thread = None
+        self.batch_stop = None
+        self.batch_workers = max(1, (os.cpu_count() or 2) - 1)
 
         # Tkinter variables
         self._initialize_tk_vars()
@@ -167,6 +329,7 @@ class AdvancedSegmentationApp:
         self.live_update_var = tk.IntVar(value=0)
         self.suggest_features_var = tk.IntVar(value=0)
         self.binary_output_var = tk.IntVar(value=1)
+        self.coarse_to_fine_var = tk.IntVar(value=0)
         self.brush_size = tk.IntVar(value=5)
         self.crop_var = tk.IntVar(value=0)
         self.train_crop_var = tk.IntVar(value=0)
@@ -174,6 +337,7 @@ class AdvancedSegmentationApp:
         self.overwrite_var = tk.IntVar(value=0)
         self.save_probabilities = tk.IntVar(value=0)
         self.save_features = tk.IntVar(value=0)
+        self.temporal_var = tk.IntVar(value=0)
         self.status_var = tk.StringVar(value="Ready")
         self.input_type = tk.StringVar(value="image")
 
@@ -219,8 +383,9 @@ class AdvancedSegmentationApp:
                                 xscrollcommand=self.hscroll.set,
                                 yscrollcommand=self.vscroll.set,
                                 highlightthickness=0)
-        self.hscroll.config(command=self.canvas.xview)
-        self.vscroll.config(command=self.canvas.yview)
+        self.hscroll.config(command=self._on_xscroll)
+        self.vscroll.config(command=self._on_yscroll)
+        self.canvas.bind("<Configure>", self.schedule_render)
 
         # Grid layout
         self.canvas.grid(row=0, column=0, sticky="nsew")
@@ -326,29 +491,18 @@ class AdvancedSegmentationApp:
 
         ttk.Label(sigma_frame, text="Sigma:").pack(side=tk.LEFT)
         self.sigma_vars = []
-        default_sigmas = [0.3, 0.7, 1.0, 1.6, 3.5, 5.0, 10.0]
-
-        for sigma in default_sigmas:
+        for sigma in DEFAULT_SIGMAS:
             var = tk.DoubleVar(value=sigma)
+            var.trace_add("write", self._schedule_feature_selection_check)
             self.sigma_vars.append(var)
             ttk.Entry(sigma_frame, textvariable=var, width=5).pack(side=tk.LEFT, padx=2)
 
         ttk.Button(sigma_frame, text="Add", command=self.add_sigma).pack(side=tk.LEFT, padx=5)
 
         # Feature checkboxes
-        features = [
-            "Gaussian Smoothing",
-            "Edge",
-            "Laplacian of Gaussian",
-            "Gaussian Gradient Magnitude",
-            "Difference of Gaussians",
-            "Texture",
-            "Structure Tensor Eigenvalues",
-            "Hessian of Gaussian Eigenvalue"
-        ]
-
-        for feature in features:
+        for feature in FEATURE_FAMILIES:
             var = tk.IntVar(value=0)
+            var.trace_add("write", self._schedule_feature_selection_check)
             self.feature_params[feature] = {"var": var}
             ttk.Checkbutton(self.feature_frame, text=feature, variable=var).pack(anchor=tk.W)
 
@@ -429,6 +583,8 @@ class AdvancedSegmentationApp:
 
         ttk.Checkbutton(self.segment_frame, text="Binary Output (White cells/Black background)",
                         variable=self.binary_output_var).pack(anchor=tk.W)
+        ttk.Checkbutton(self.segment_frame, text="Coarse-to-fine (refine boundaries only)",
+                        variable=self.coarse_to_fine_var).pack(anchor=tk.W)
 
         btn_frame = ttk.Frame(self.segment_frame)
         btn_frame.pack(fill=tk.X, pady=5)
@@ -458,6 +614,8 @@ class AdvancedSegmentationApp:
                         variable=self.save_probabilities).pack(anchor=tk.W)
         ttk.Checkbutton(self.batch_frame, text="Save feature stacks",
                         variable=self.save_features).pack(anchor=tk.W)
+        ttk.Checkbutton(self.batch_frame, text="Video: recompute changed regions only",
+                        variable=self.temporal_var).pack(anchor=tk.W)
 
         # Buttons
         btn_frame = ttk.Frame(self.batch_frame)
@@ -482,13 +640,22 @@ class AdvancedSegmentationApp:
         """Configure logging system"""
         log_folder = "logs"
         os.makedirs(log_folder, exist_ok=True)
-        log_file = os.path.join(log_folder, f"segmentation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+        log_name = f"segmentation_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        text_handlers = [logging.FileHandler(os.path.join(log_folder, log_name + ".log")), logging.StreamHandler()]
+        for handler in text_handlers:
+            # Metrics snapshots only go to the structured log
+            handler.addFilter(lambda record: not hasattr(record, "metrics"))
+        json_handler = logging.FileHandler(os.path.join(log_folder, log_name + ".jsonl"))
+        json_handler.setFormatter(metrics.JsonFormatter())
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[logging.FileHandler(log_file), logging.StreamHandler()]
+            handlers=text_handlers + [json_handler]
         )
 
+        # Stage timings, cache hit rates and throughput, scraped from logs/metrics.prom
+        metrics.registry.start_export(os.path.join(log_folder, "metrics.prom"))
+
     def clear_output_folders(self):
         """Clear all output folders"""
         for folder in [self.output_folder, self.frames_folder]:
@@ -541,7 +708,7 @@ class AdvancedSegmentationApp:
 
     def show_video_settings_dialog(self):
         """Show dialog to configure video extraction settings"""
-        if not self.input_path or not self.input_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
+        if not self.input_path or not self.input_path.lower().endswith(VIDEO_EXTENSIONS):
             return
 
         # Create settings window
@@ -636,33 +803,20 @@ class AdvancedSegmentationApp:
             messagebox.showerror("Error", f"Invalid input: {str(e)}")
 
     def load_video_frames(self, frame_interval=1, max_frames=50):
-        """Load frames from video with specified settings"""
+        """Open a lazy frame store for the video with specified settings"""
         try:
-            cap = cv2.VideoCapture(self.input_path)
-            if not cap.isOpened():
-                raise ValueError("Failed to open video")
+            self.frame_interval = frame_interval
+            self.max_frames = max_frames
 
+            if isinstance(self.video_frames, VideoFrameStore):
+                self.video_frames.close()
             self.video_frames = []
-            frame_count = 0
-            frames_loaded = 0
-
-            while cap.isOpened() and frames_loaded < max_frames:
-                ret, frame = cap.read()
-                if not ret:
-                    break
 
-                if frame_count % frame_interval == 0:
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    timestamp = frame_count / self.video_fps
-                    self.video_frames.append((frame_count, frame, f"frame_{frame_count:04d}.png", timestamp))
-                    frames_loaded += 1
-
-                frame_count += 1
-
-            cap.release()
-
-            if not self.video_frames:
+            store = VideoFrameStore(self.input_path, frame_interval, max_frames)
+            if not store:
+                store.close()
                 raise ValueError("No frames loaded from video")
+            self.video_frames = store
 
             self.show_frame_selector()
             self.colony_preview_btn.config(state=tk.NORMAL)
@@ -785,6 +939,9 @@ class AdvancedSegmentationApp:
             self.frame_slider.set(frame_idx)
             self.vertical_slider.set(frame_idx)
 
+            if isinstance(self.video_frames, VideoFrameStore):
+                self.video_frames.prefetch(frame_idx)
+
     def select_and_display_frame(self, selector):
         """Set the selected frame as reference and display in main window"""
         frame_idx = self.current_frame_idx
@@ -850,7 +1007,7 @@ class AdvancedSegmentationApp:
         """Load images from selected folder"""
         try:
             self.image_files = [f for f in os.listdir(self.input_path)
-                                if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff'))]
+                                if f.lower().endswith(IMAGE_EXTENSIONS)]
 
             if not self.image_files:
                 raise ValueError("No images found in folder")
@@ -933,46 +1090,69 @@ class AdvancedSegmentationApp:
         ttk.Button(btn_frame, text="Close", command=preview_win.destroy).pack(side=tk.RIGHT)
 
         # Initialize preview
-        self.colony_preview_playing = False
+        self.stop_colony_preview()
+        if self.colony_proxies is not None:
+            self.colony_proxies.close()
         max_frames = len(self.video_frames) if self.video_frames else len(self.image_files)
+        self.colony_proxies = ProxyCache(self._load_colony_frame, max_frames)
+        self.colony_idx = 0
+        self.colony_direction = 1
+
+        canvas.bind("<Configure>", lambda e: self.update_colony_preview(canvas, self.colony_idx))
+        preview_win.bind("<Destroy>", lambda e: self._close_colony_preview(e, preview_win))
+
         self.colony_slider.config(to=max_frames - 1)
         self.colony_vertical_slider.config(to=max_frames - 1)
         self.update_colony_preview(canvas, 0)
 
+    def _close_colony_preview(self, event, preview_win):
+        """Stop playback and release the proxy cache when the preview window closes"""
+        if event.widget is not preview_win:
+            return
+        self.stop_colony_preview()
+        if self.colony_proxies is not None:
+            self.colony_proxies.close()
+            self.colony_proxies = None
+
+    def _load_colony_frame(self, idx):
+        """Load a full-resolution RGB frame for the colony preview"""
+        if self.video_frames:
+            return self.video_frames[idx][1]
+        img_path = os.path.join(self.input_path, self.image_files[idx])
+        frame = cv2.imread(img_path)
+        if frame is None:
+            raise ValueError(f"Failed to read {self.image_files[idx]}")
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
     def update_colony_preview(self, canvas, idx):
         """Update the colony growth preview display"""
-        if not self.video_frames and not self.image_files:
+        if (not self.video_frames and not self.image_files) or self.colony_proxies is None:
             return
 
         if self.video_frames:
-            max_idx = len(self.video_frames) - 1
-            idx = min(idx, max_idx)
-            frame = self.video_frames[idx][1]
+            idx = min(idx, len(self.video_frames) - 1)
             self.colony_frame_info.config(text=f"Frame {idx + 1} of {len(self.video_frames)}")
         else:
-            max_idx = len(self.image_files) - 1
-            idx = min(idx, max_idx)
-            img_path = os.path.join(self.input_path, self.image_files[idx])
-            frame = cv2.imread(img_path)
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            idx = min(idx, len(self.image_files) - 1)
             self.colony_frame_info.config(text=f"Image {idx + 1} of {len(self.image_files)}")
 
-        img_pil = Image.fromarray(frame)
         canvas_width = canvas.winfo_width()
         canvas_height = canvas.winfo_height()
+        if canvas_width > 1 and canvas_height > 1:
+            self.colony_proxies.resize((canvas_width, canvas_height))
 
-        if canvas_width > 0 and canvas_height > 0:
-            img_aspect = img_pil.width / img_pil.height
-            canvas_aspect = canvas_width / canvas_height
-
-            if img_aspect > canvas_aspect:
-                new_width = canvas_width
-                new_height = int(canvas_width / img_aspect)
-            else:
-                new_height = canvas_height
-                new_width = int(canvas_height * img_aspect)
+        # Read ahead in the scrubbing direction; playback drives its own requests
+        if idx != self.colony_idx:
+            self.colony_direction = 1 if idx > self.colony_idx else -1
+        self.colony_idx = idx
+        if not self.colony_preview_playing:
+            self.colony_proxies.request(idx, self.colony_direction)
 
-            img_pil = img_pil.resize((new_width, new_height), Image.LANCZOS)
+        try:
+            img_pil = self.colony_proxies.get(idx, build=True)
+        except Exception as e:
+            logging.error(f"Colony preview failed: {str(e)}")
+            return
 
         img_tk = ImageTk.PhotoImage(img_pil)
         canvas.delete("all")
@@ -989,56 +1169,191 @@ class AdvancedSegmentationApp:
 
         self.colony_preview_playing = True
         max_frames = len(self.video_frames) if self.video_frames else len(self.image_files)
+        start = time.perf_counter()
+        shown = -1
+
+        # The clock picks the frame; if its proxy is not ready yet, show the newest ready
+        # one since the last shown frame and drop the rest
+        def animate():
+            nonlocal shown
+            if not self.colony_preview_playing:
+                return
 
-        def animate(frame_idx):
-            if not self.colony_preview_playing or frame_idx >= max_frames:
+            target = min(int((time.perf_counter() - start) * self.colony_playback_fps), max_frames - 1)
+            self.colony_proxies.request(target, 1)
+            ready = self.colony_proxies.newest_ready(shown + 1, target)
+            if ready is not None:
+                shown = ready
+                self.update_colony_preview(canvas, ready)
+
+            if shown >= max_frames - 1:
                 self.colony_preview_playing = False
+                self.colony_play_id = None
                 return
+            self.colony_play_id = self.root.after(max(1, 500 // self.colony_playback_fps), animate)
 
-            self.update_colony_preview(canvas, frame_idx)
-            self.root.after(200, lambda: animate(frame_idx + 1))
-
-        animate(0)
+        animate()
 
     def stop_colony_preview(self):
         """Stop the colony growth animation"""
         self.colony_preview_playing = False
+        if self.colony_play_id is not None:
+            self.root.after_cancel(self.colony_play_id)
+            self.colony_play_id = None
 
     def display_preview(self):
         """Display preview of current image with optional overlay"""
         if self.current_image is None:
             return
 
-        img_pil = Image.fromarray(self.current_image)
+        self.img_width = self.current_image.shape[1]
+        self.img_height = self.current_image.shape[0]
+        zoom_width, zoom_height = self._display_size()
 
-        if self.label_mask is not None and np.any(self.label_mask > 0):
-            overlay = np.zeros_like(self.current_image)
-            for label, color in self.label_colors.items():
-                mask = self.label_mask == label
-                overlay[mask] = color
+        self.canvas.delete("all")
+        self.img_tk = None
+        self.viewport = None
+        self.canvas.config(scrollregion=(0, 0, zoom_width, zoom_height))
+        self.render_viewport()
+
+    def _display_size(self):
+        """Return the size of the whole image at the current zoom level"""
+        return (max(1, int(self.img_width * self.zoom_level)),
+                max(1, int(self.img_height * self.zoom_level)))
+
+    def schedule_render(self, *args):
+        """Coalesce viewport redraws from scroll and resize events into one idle callback"""
+        if not self.render_pending and self.current_image is not None:
+            self.render_pending = True
+            self.root.after_idle(self.render_viewport)
+
+    def _on_xscroll(self, *args):
+        self.canvas.xview(*args)
+        self.schedule_render()
+
+    def _on_yscroll(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_render()
+
+    def render_viewport(self):
+        """Composite and scale only the part of the image visible on the canvas"""
+        self.render_pending = False
+        if self.current_image is None:
+            return
 
-            blended = cv2.addWeighted(self.current_image, 0.7, overlay, 0.3, 0)
-            img_pil = Image.fromarray(blended)
+        zoom_width, zoom_height = self._display_size()
+        x0 = max(0, int(self.canvas.canvasx(0)))
+        y0 = max(0, int(self.canvas.canvasy(0)))
+        x1 = min(zoom_width, x0 + max(1, self.canvas.winfo_width()))
+        y1 = min(zoom_height, y0 + max(1, self.canvas.winfo_height()))
+        if x1 <= x0 or y1 <= y0:
+            return
+        if self.viewport == (x0, y0, x1, y1) and self.img_tk is not None:
+            return
 
-        if self.zoom_level != 1.0:
-            new_width = int(img_pil.width * self.zoom_level)
-            new_height = int(img_pil.height * self.zoom_level)
-            img_pil = img_pil.resize((new_width, new_height), Image.LANCZOS)
+        self.img_tk = ImageTk.PhotoImage(self._render_display_rect(x0, y0, x1, y1))
+        self.canvas.delete("viewport")
+        self.canvas.create_image(x0, y0, anchor=tk.NW, image=self.img_tk, tags="viewport")
+        self.canvas.tag_lower("viewport")
+        self.viewport = (x0, y0, x1, y1)
+
+    def _label_lut(self):
+        """Return a label -> RGBA lookup table; unlabeled pixels are transparent"""
+        lut = np.zeros((256, 4), dtype=np.uint16)
+        for label, color in self.label_colors.items():
+            if 0 < label < 256:
+                lut[label, :3] = color
+                lut[label, 3] = 77
+        return lut
+
+    def _blend_region(self, y0, y1, x0, x1):
+        """Blend the label overlay into a window of the current image"""
+        region = self.current_image[y0:y1, x0:x1]
+        if self.label_mask is None and self.live_labels is None:
+            return region.copy()
+
+        # Scribbles are drawn over the live preview labels
+        if self.live_labels is None:
+            labels = self.label_mask[y0:y1, x0:x1]
+        elif self.label_mask is None:
+            labels = self.live_labels[y0:y1, x0:x1]
+        else:
+            scribbles = self.label_mask[y0:y1, x0:x1]
+            labels = np.where(scribbles > 0, scribbles, self.live_labels[y0:y1, x0:x1])
+
+        rgba = self._label_lut()[labels]
+        alpha = rgba[:, :, 3:]
+        blended = (region * (255 - alpha) + rgba[:, :, :3] * alpha + 127) // 255
+        return blended.astype(np.uint8)
+
+    def _composite(self):
+        """Return the full-resolution blended image, cached until its inputs change"""
+        sources = (self.current_image, self.label_mask, self.live_labels)
+        if self.composite_cache is None or any(a is not b for a, b in zip(sources, self.composite_sources)):
+            self.composite_sources = sources
+            self.composite_cache = self._blend_region(0, self.current_image.shape[0], 0, self.current_image.shape[1])
+        return self.composite_cache
+
+    def invalidate_composite(self):
+        """Drop the cached composite after an in-place label edit"""
+        self.composite_cache = None
+
+    def _render_display_rect(self, dest_x0, dest_y0, dest_x1, dest_y1):
+        """Render a rectangle of display (zoomed) pixels from the cached composite"""
+        composite = self._composite()
+        if self.zoom_level == 1.0:
+            return Image.fromarray(composite[dest_y0:dest_y1, dest_x0:dest_x1])
+
+        # Resample from a source window with enough margin for the LANCZOS kernel, so
+        # the rectangle matches the same pixels of a full-frame resize
+        height, width = composite.shape[:2]
+        zoom_width, zoom_height = self._display_size()
+        scale_x = width / zoom_width
+        scale_y = height / zoom_height
+        margin = int(np.ceil(3 * max(scale_x, scale_y, 1.0))) + 1
+        y0 = max(0, int(dest_y0 * scale_y) - margin)
+        y1 = min(height, int(np.ceil(dest_y1 * scale_y)) + margin)
+        x0 = max(0, int(dest_x0 * scale_x) - margin)
+        x1 = min(width, int(np.ceil(dest_x1 * scale_x)) + margin)
+
+        source = Image.fromarray(composite[y0:y1, x0:x1])
+        box = (dest_x0 * scale_x - x0, dest_y0 * scale_y - y0,
+               dest_x1 * scale_x - x0, dest_y1 * scale_y - y0)
+        return source.resize((dest_x1 - dest_x0, dest_y1 - dest_y0), Image.LANCZOS, box=box)
+
+    def redraw_region(self, y0, y1, x0, x1):
+        """Update the composite for a dirty window of labels and redraw it if visible"""
+        if self.img_tk is None or self.viewport is None:
+            self.display_preview()
+            return
 
-        img_tk = ImageTk.PhotoImage(img_pil)
-        self.canvas.delete("all")
-        self.img_tk = img_tk
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=img_tk)
-        self.canvas.config(scrollregion=self.canvas.bbox(tk.ALL))
+        self._composite()[y0:y1, x0:x1] = self._blend_region(y0, y1, x0, x1)
+
+        # Display pixels whose resampling kernel reaches the dirty window
+        zoom_width, zoom_height = self._display_size()
+        scale_x = self.img_width / zoom_width
+        scale_y = self.img_height / zoom_height
+        reach = int(np.ceil(3 * max(1.0, self.zoom_level))) + 1 if self.zoom_level != 1.0 else 0
+        view_x0, view_y0, view_x1, view_y1 = self.viewport
+        dest_x0 = max(view_x0, int(x0 / scale_x) - reach)
+        dest_y0 = max(view_y0, int(y0 / scale_y) - reach)
+        dest_x1 = min(view_x1, int(np.ceil(x1 / scale_x)) + reach)
+        dest_y1 = min(view_y1, int(np.ceil(y1 / scale_y)) + reach)
+        if dest_x1 <= dest_x0 or dest_y1 <= dest_y0:
+            return
 
-        self.img_width = self.current_image.shape[1]
-        self.img_height = self.current_image.shape[0]
+        patch_tk = ImageTk.PhotoImage(self._render_display_rect(dest_x0, dest_y0, dest_x1, dest_y1))
+        self.canvas.tk.call(str(self.img_tk), "copy", str(patch_tk), "-to", dest_x0 - view_x0, dest_y0 - view_y0)
 
     def initialize_label_mask(self):
         """Initialize the label mask for interactive labeling"""
         if self.current_image is not None:
             height, width = self.current_image.shape[:2]
             self.label_mask = np.zeros((height, width), dtype=np.uint8)
+            self.last_x = None
+            self.last_y = None
+            self.live_generation += 1
+            self.live_labels = None
 
     def adjust_zoom(self, factor):
         """Adjust zoom level"""
@@ -1167,6 +1482,7 @@ class AdvancedSegmentationApp:
         self.canvas.unbind("<ButtonRelease-1>")
         self.canvas.bind("<B1-Motion>", self.paint_label)
         self.canvas.bind("<Button-1>", self.paint_label)
+        self.canvas.bind("<ButtonRelease-1>", self.reset_last_coords)
 
     def reset_crop(self):
         """Reset the crop to original image"""
@@ -1181,6 +1497,7 @@ class AdvancedSegmentationApp:
         """Clear all interactive labels"""
         if self.label_mask is not None:
             self.label_mask.fill(0)
+            self.invalidate_composite()
             self.display_preview()
 
     def reset_enhancements(self):
@@ -1249,13 +1566,49 @@ class AdvancedSegmentationApp:
         else:
             return
 
-        for y in range(max(0, img_y - half_size), min(self.img_height, img_y + half_size + 1)):
-            for x in range(max(0, img_x - half_size), min(self.img_width, img_x + half_size + 1)):
-                dist = np.sqrt((x - img_x) ** 2 + (y - img_y) ** 2)
-                if dist <= half_size:
-                    self.label_mask[y, x] = label_value
+        # Interpolate from the previous motion event so fast strokes leave no gaps
+        if self.last_x is None:
+            points = [(img_x, img_y)]
+        else:
+            spacing = max(1, half_size // 2)
+            steps = max(abs(img_x - self.last_x), abs(img_y - self.last_y)) // spacing + 1
+            xs = np.rint(np.linspace(self.last_x, img_x, steps + 1)).astype(int)
+            ys = np.rint(np.linspace(self.last_y, img_y, steps + 1)).astype(int)
+            points = zip(xs[1:], ys[1:])
+        self.last_x = img_x
+        self.last_y = img_y
+
+        dirty = self.stamp_brush(points, half_size, label_value)
+        self.redraw_region(*dirty)
 
-        self.display_preview()
+        if self.live_update_var.get():
+            self.schedule_live_update()
+
+    def _brush_stencil(self, radius):
+        """Return a cached boolean disk of the given radius"""
+        stencil = self.brush_stencils.get(radius)
+        if stencil is None:
+            yy, xx = np.ogrid[-radius:radius + 1, -radius:radius + 1]
+            stencil = xx * xx + yy * yy <= radius * radius
+            self.brush_stencils[radius] = stencil
+        return stencil
+
+    def stamp_brush(self, points, radius, label_value):
+        """Stamp a disk at each (x, y) point and return the dirty (y0, y1, x0, x1) window"""
+        stencil = self._brush_stencil(radius)
+        height, width = self.label_mask.shape
+        dirty_y0, dirty_y1, dirty_x0, dirty_x1 = height, 0, width, 0
+
+        for x, y in points:
+            y0, y1 = max(0, y - radius), min(height, y + radius + 1)
+            x0, x1 = max(0, x - radius), min(width, x + radius + 1)
+            window = stencil[y0 - (y - radius):y1 - (y - radius), x0 - (x - radius):x1 - (x - radius)]
+            self.label_mask[y0:y1, x0:x1][window] = label_value
+
+            dirty_y0, dirty_y1 = min(dirty_y0, y0), max(dirty_y1, y1)
+            dirty_x0, dirty_x1 = min(dirty_x0, x0), max(dirty_x1, x1)
+
+        return dirty_y0, dirty_y1, dirty_x0, dirty_x1
 
     def reset_last_coords(self, event):
         """Reset the last coordinates for painting"""
@@ -1272,128 +1625,151 @@ class AdvancedSegmentationApp:
             self.status_var.set("Training classifier...")
             self.root.update()
 
+            # Outdate a running live refit, so it cannot replace the classifier trained here
+            self.cancel_live_update()
             self.reference_image = self.current_image.copy()
-            features = self.extract_features(self.reference_image)
-
-            X = []
-            y = []
-
-            for i in range(self.current_image.shape[0]):
-                for j in range(self.current_image.shape[1]):
-                    if self.label_mask[i, j] > 0:
-                        pixel_features = []
-                        for feature_type, feature_data in features.items():
-                            if isinstance(feature_data, np.ndarray):
-                                if len(feature_data.shape) == 2:
-                                    pixel_features.append(feature_data[i, j])
-                                else:
-                                    pixel_features.extend(feature_data[i, j])
-
-                        X.append(pixel_features)
-                        y.append(self.label_mask[i, j])
-
-            if len(X) == 0:
-                raise ValueError("No labeled pixels found")
-
-            if self.training_data is None:
-                self.training_data = np.array(X)
-                self.training_labels = np.array(y)
-            else:
-                self.training_data = np.vstack((self.training_data, X))
-                self.training_labels = np.concatenate((self.training_labels, y))
+            with self.training_lock:
+                if not self.update_training_set(self.reference_image, self.label_mask) and \
+                        self.classifier is not None:
+                    self.status_var.set("No label changes since last training")
+                    return
 
-            self.classifier = RandomForestClassifier(n_estimators=100, random_state=42)
-            self.classifier.fit(self.training_data, self.training_labels)
+                if self.training_set.size == 0:
+                    raise ValueError("No labeled pixels found")
+
+                self.classifier = train_forest(self.training_data, self.training_labels)
 
             messagebox.showinfo("Training Complete", "Classifier trained successfully")
             self.status_var.set("Classifier trained")
             self.current_step = 3
             self.update_ui_state()
+            if self.live_update_var.get():
+                self.schedule_live_update()
+
+            if self.suggest_features_var.get():
+                self.suggest_feature_pruning()
 
         except Exception as e:
             logging.error(f"Training failed: {str(e)}")
             messagebox.showerror("Error", f"Training failed: {str(e)}")
             self.status_var.set(f"Error: {str(e)}")
 
-    def extract_features(self, img):
-        """Extract features based on current selection"""
-        features = {}
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-
-        # Gaussian Smoothing
-        if "Gaussian Smoothing" in self.feature_params and self.feature_params["Gaussian Smoothing"]["var"].get():
-            for i, sigma_var in enumerate(self.sigma_vars):
-                sigma = sigma_var.get()
-                if sigma > 0:
-                    features[f"Gaussian_{i}"] = gaussian(gray, sigma=sigma)
-
-        # Edge detection
-        if "Edge" in self.feature_params and self.feature_params["Edge"]["var"].get():
-            gx = sobel(gray, axis=0)
-            gy = sobel(gray, axis=1)
-            features["Edge"] = np.stack([gx, gy], axis=-1)
-
-        # Laplacian of Gaussian
-        if "Laplacian of Gaussian" in self.feature_params and self.feature_params["Laplacian of Gaussian"]["var"].get():
-            for i, sigma_var in enumerate(self.sigma_vars):
-                sigma = sigma_var.get()
-                if sigma > 0:
-                    features[f"LoG_{i}"] = laplace(gaussian(gray, sigma=sigma))
-
-        # Gaussian Gradient Magnitude
-        if "Gaussian Gradient Magnitude" in self.feature_params and self.feature_params["Gaussian Gradient Magnitude"][
-            "var"].get():
-            for i, sigma_var in enumerate(self.sigma_vars):
-                sigma = sigma_var.get()
-                if sigma > 0:
-                    gx = gaussian(gray, sigma=sigma, order=[0, 1])
-                    gy = gaussian(gray, sigma=sigma, order=[1, 0])
-                    features[f"GGM_{i}"] = np.sqrt(gx ** 2 + gy ** 2)
-
-        # Difference of Gaussians
-        if "Difference of Gaussians" in self.feature_params and self.feature_params["Difference of Gaussians"][
-            "var"].get():
-            for i in range(len(self.sigma_vars) - 1):
-                sigma1 = self.sigma_vars[i].get()
-                sigma2 = self.sigma_vars[i + 1].get()
-                if sigma1 > 0 and sigma2 > 0:
-                    g1 = gaussian(gray, sigma=sigma1)
-                    g2 = gaussian(gray, sigma=sigma2)
-                    features[f"DoG_{i}"] = g1 - g2
-
-        # Texture features
-        if "Texture" in self.feature_params and self.feature_params["Texture"]["var"].get():
-            for i, sigma_var in enumerate(self.sigma_vars):
-                sigma = sigma_var.get()
-                if sigma > 0:
-                    filt_real, filt_imag = gabor(gray, frequency=0.6, sigma_x=sigma, sigma_y=sigma)
-                    features[f"Gabor_{i}"] = np.sqrt(filt_real ** 2 + filt_imag ** 2)
-
-        # Structure Tensor Eigenvalues
-        if "Structure Tensor Eigenvalues" in self.feature_params and \
-                self.feature_params["Structure Tensor Eigenvalues"]["var"].get():
-            gx = sobel(gray, axis=0)
-            gy = sobel(gray, axis=1)
-            gxx = gaussian(gx * gx, sigma=1)
-            gxy = gaussian(gx * gy, sigma=1)
-            gyy = gaussian(gy * gy, sigma=1)
-
-            lambda1 = 0.5 * (gxx + gyy + np.sqrt((gxx - gyy) ** 2 + 4 * gxy ** 2))
-            lambda2 = 0.5 * (gxx + gyy - np.sqrt((gxx - gyy) ** 2 + 4 * gxy ** 2))
-
-            features["Structure Tensor"] = np.stack([lambda1, lambda2], axis=-1)
-
-        # Hessian of Gaussian Eigenvalue
-        if "Hessian of Gaussian Eigenvalue" in self.feature_params and \
-                self.feature_params["Hessian of Gaussian Eigenvalue"]["var"].get():
-            for i, sigma_var in enumerate(self.sigma_vars):
-                sigma = sigma_var.get()
-                if sigma > 0:
-                    H = hessian_matrix(gray, sigma=sigma, order='rc')
-                    eigenvalues = hessian_matrix_eigvals(H)
-                    features[f"Hessian_{i}"] = eigenvalues[0]
-
-        return features
+    def update_training_set(self, img, label_mask, config=None, max_rows_per_label=None, workers=None):
+        """Add rows for newly labeled pixels and drop rows for erased or relabeled ones.
+
+        New pixels first go through the per-label reservoirs, and only the padded bounding
+        box of the ones sampled in is featurized. Returns False when the labels are
+        unchanged since the last update.
+
+        Background callers pass the feature config, row budget and worker count read on the
+        Tk thread; left as None they are read from the GUI here.
+        """
+        if config is None:
+            config = self._feature_config()
+        if max_rows_per_label is None:
+            max_rows_per_label = self.max_training_rows_per_label
+        if workers is None:
+            workers = self.feature_workers
+        if not config["features"]:
+            raise ValueError("No features selected")
+        if self.training_set is None or self.training_set.config != config or \
+                self.training_set.max_rows_per_label != max_rows_per_label:
+            self.training_set = TrainingSet(config, max_rows_per_label=max_rows_per_label)
+
+        # Rows are keyed by image only, so pruning channels in place keeps every source
+        key = FeatureCache.make_key(img, None)
+        if not self.training_set.update(key, label_mask,
+                                        lambda region: region_features(img, config, region, workers)):
+            return False
+
+        self.training_data = self.training_set.features[:self.training_set.size]
+        self.training_labels = self.training_set.labels[:self.training_set.size]
+        return True
+
+    def _feature_enabled(self, feature):
+        """Check whether a feature family is selected"""
+        return feature in self.feature_params and self.feature_params[feature]["var"].get()
+
+    def _feature_selection(self):
+        """Return the checked feature families and the sigma values"""
+        return ([feature for feature in self.feature_params if self._feature_enabled(feature)],
+                [sigma_var.get() for sigma_var in self.sigma_vars])
+
+    def _feature_config(self):
+        """Return the selected features and sigmas as a plain, hashable-by-JSON config"""
+        features, sigmas = self._feature_selection()
+        if self.feature_channels is not None and (features, sigmas) != self.pruned_selection:
+            # Pruned channels only hold for the selection they were ranked on
+            self.feature_channels = None
+            self.pruned_selection = None
+        return feature_config(features, sigmas, self.feature_channels)
+
+    def _schedule_feature_selection_check(self, *args):
+        """Debounce family and sigma edits before checking them against a pruned model"""
+        if self.feature_change_after_id is not None:
+            self.root.after_cancel(self.feature_change_after_id)
+        self.feature_change_after_id = self.root.after(500, self._check_feature_selection)
+
+    def _check_feature_selection(self):
+        """Drop the pruned channels and retrain once the family or sigma selection changes"""
+        self.feature_change_after_id = None
+        if self.feature_channels is None:
+            return
+        try:
+            selection = self._feature_selection()
+        except tk.TclError:
+            return  # A sigma entry is mid-edit
+        if selection == self.pruned_selection:
+            return
+
+        self.feature_channels = None
+        self.pruned_selection = None
+        self.status_var.set("Feature selection changed, full feature set restored")
+        if self.classifier is not None and self.current_image is not None and \
+                self.label_mask is not None and np.any(self.label_mask > 0):
+            self.train_classifier()
+
+    def extract_features(self, img, region=None):
+        """Extract features based on current selection into a FeatureStack.
+
+        Each (feature, sigma) job runs on a thread pool and writes into its own channel
+        slice of a preallocated stack, so channel order does not depend on completion order.
+        Stacks are stored in the on-disk feature cache and reloaded memory-mapped when the
+        same pixels are requested again with the same feature and sigma selection.
+
+        With region=(y0, y1, x0, x1) only that window is featurized, from a crop padded by
+        the widest filter support so the values match the full-image stack.
+        """
+        config = self._feature_config()
+        if region is not None:
+            return region_features(img, config, region, self.feature_workers)
+
+        def compute():
+            # Reuse smoothed images across feature families and calls until the image changes
+            scale_space = self.scale_space
+            if scale_space is None or scale_space.source is not img:
+                scale_space = ScaleSpace(img, cv2.cvtColor(img, cv2.COLOR_RGB2GRAY))
+                self.scale_space = scale_space
+            return compute_features(scale_space, config, self.feature_workers)
+
+        return self._cached_features(img, config, compute)
+
+    def _cached_features(self, img, config, compute):
+        """Load a stack from the feature cache, or compute and store it"""
+        cache_key = None
+        if self.feature_cache is not None:
+            cache_key = FeatureCache.make_key(img, config)
+            cached = self.feature_cache.load(cache_key)
+            if cached is not None:
+                return cached
+
+        stack = compute()
+        if cache_key is not None:
+            try:
+                self.feature_cache.store(cache_key, stack)
+            except OSError as e:
+                logging.error(f"Feature cache write failed: {str(e)}")
+        return stack
 
     def apply_features(self):
         """Apply selected features and update display"""
@@ -1405,20 +1781,14 @@ class AdvancedSegmentationApp:
             self.status_var.set("Applying features...")
             self.root.update()
 
-            features = self.extract_features(self.current_image)
+            stack = self.extract_features(self.current_image)
 
-            if features:
-                first_feature = next(iter(features.values()))
-                if isinstance(first_feature, np.ndarray):
-                    if len(first_feature.shape) == 2:
-                        norm_feature = cv2.normalize(first_feature, None, 0, 255, cv2.NORM_MINMAX)
-                        display_img = cv2.cvtColor(norm_feature.astype(np.uint8), cv2.COLOR_GRAY2RGB)
-                    else:
-                        norm_feature = cv2.normalize(first_feature[:, :, 0], None, 0, 255, cv2.NORM_MINMAX)
-                        display_img = cv2.cvtColor(norm_feature.astype(np.uint8), cv2.COLOR_GRAY2RGB)
+            if stack.num_channels > 0:
+                norm_feature = cv2.normalize(stack.data[:, :, 0], None, 0, 255, cv2.NORM_MINMAX)
+                display_img = cv2.cvtColor(norm_feature.astype(np.uint8), cv2.COLOR_GRAY2RGB)
 
-                    self.current_image = display_img
-                    self.display_preview()
+                self.current_image = display_img
+                self.display_preview()
 
             self.status_var.set("Features applied")
 
@@ -1442,8 +1812,7 @@ class AdvancedSegmentationApp:
             self.progress['value'] = 0
             self.root.update()
 
-            features = self.extract_features(self.current_image)
-            segmented = self.segment_image(self.current_image, features)
+            segmented, summary = self._segment_current(self.current_image, self._update_segment_progress)
 
             if self.binary_output_var.get():
                 segmented = self.convert_to_binary(segmented)
@@ -1455,47 +1824,51 @@ class AdvancedSegmentationApp:
             self.show_result(segmented)
 
             self.progress['value'] = 100
-            self.status_var.set("Processing completed")
+            self.status_var.set(f"Processing completed{summary}")
 
         except Exception as e:
             logging.error(f"Processing failed: {str(e)}")
             messagebox.showerror("Error", f"Processing failed: {str(e)}")
             self.status_var.set(f"Error: {str(e)}")
 
-    def segment_image(self, img, features):
-        """Perform segmentation using extracted features and trained classifier"""
-        try:
-            height, width = img.shape[:2]
-            X = []
+    def segment_image(self, img, features, block_rows=None, progress_callback=None):
+        """Perform segmentation using an extracted FeatureStack and trained classifier.
 
-            for i in range(height):
-                for j in range(width):
-                    pixel_features = []
-                    for feature_type, feature_data in features.items():
-                        if isinstance(feature_data, np.ndarray):
-                            if len(feature_data.shape) == 2:
-                                pixel_features.append(feature_data[i, j])
-                            else:
-                                pixel_features.extend(feature_data[i, j])
-                    X.append(pixel_features)
+        Prediction runs over fixed-size row blocks written into a preallocated label
+        image, so peak memory is bounded by the block size rather than the image size.
+        """
+        try:
+            return predict_labels(self.classifier, features, block_rows or self.prediction_block_rows,
+                                  progress_callback, self.prediction_workers)
 
-            labels = self.classifier.predict(X)
-            labels = labels.reshape((height, width))
+        except Exception as e:
+            logging.error(f"Segmentation failed: {str(e)}")
+            raise ValueError(f"Segmentation error: {str(e)}")
 
-            return labels
+    def _segment_current(self, img, progress_callback=None):
+        """Segment an image with the current settings, returning the labels and a status suffix"""
+        if not self.coarse_to_fine_var.get():
+            features = self.extract_features(img)
+            return self.segment_image(img, features, progress_callback=progress_callback), ""
 
+        try:
+            labels, report = coarse_to_fine_labels(self.classifier, img, self._feature_config(),
+                                                   tolerance=self.coarse_to_fine_tolerance,
+                                                   workers=self.prediction_workers)
         except Exception as e:
-            logging.error(f"Segmentation failed: {str(e)}")
+            logging.error(f"Coarse-to-fine segmentation failed: {str(e)}")
             raise ValueError(f"Segmentation error: {str(e)}")
+        logging.info(f"Coarse-to-fine levels: {report['levels']}")
+        return labels, f" ({describe_levels(report)})"
+
+    def _update_segment_progress(self, fraction):
+        """Show partial segmentation progress on the progress bar"""
+        self.progress['value'] = 100 * fraction
+        self.root.update_idletasks()
 
     def convert_to_binary(self, segmented):
         """Convert segmented image to binary mask"""
-        binary_mask = np.zeros_like(segmented)
-        binary_mask[segmented == 1] = 255
-        binary_mask[segmented == 2] = 0
-        binary_mask[segmented == 3] = 255
-        binary_mask[segmented == 4] = 255
-        return binary_mask
+        return labels_to_binary(segmented)
 
     def show_result(self, segmented):
         """Display segmentation result"""
@@ -1521,34 +1894,359 @@ class AdvancedSegmentationApp:
             self.status_var.set("Previewing segmentation...")
             self.root.update()
 
-            features = self.extract_features(self.current_image)
-            segmented = self.segment_image(self.current_image, features)
+            segmented, summary = self._segment_current(self.current_image)
 
             if self.binary_output_var.get():
                 segmented = self.convert_to_binary(segmented)
 
             self.show_result(segmented)
-            self.status_var.set("Segmentation preview complete")
+            self.status_var.set(f"Segmentation preview complete{summary}")
 
         except Exception as e:
             logging.error(f"Preview failed: {str(e)}")
             messagebox.showerror("Error", f"Preview failed: {str(e)}")
             self.status_var.set(f"Error: {str(e)}")
 
+    def select_output_folder(self):
+        """Choose the folder batch results are written to"""
+        folder = filedialog.askdirectory(title="Select Output Folder")
+        if folder:
+            self.output_folder = folder
+            os.makedirs(self.output_folder, exist_ok=True)
+            self.batch_status.config(text=f"Output folder: {folder}")
+
+    def _batch_source(self):
+        """Return (total, decoder of (name, BGR array)) for the current input, skipping existing outputs"""
+        options = {"output_folder": self.output_folder, "extension": OUTPUT_EXTENSIONS[self.output_format.get()]}
+        # skip runs on the pipeline's source thread, so it must not read Tk variables
+        overwrite = bool(self.overwrite_var.get())
+
+        def skip(name):
+            return not overwrite and os.path.exists(segmented_path(options, name))
+
+        return batch_source(self.input_type.get(), self.input_path, skip, self.frame_interval, self.max_frames)
+
+    def start_batch_processing(self):
+        """Segment every image or video frame of the current input in a background pipeline"""
+        if self.batch_running:
+            return
+
+        if not self.input_path:
+            messagebox.showwarning("Warning", "No input selected")
+            return
+
+        if self.classifier is None:
+            messagebox.showwarning("Warning", "Please train the classifier first")
+            return
+
+        try:
+            os.makedirs(self.output_folder, exist_ok=True)
+            total, frames = self._batch_source()
+            options = batch_options(
+                self.output_folder,
+                binary=bool(self.binary_output_var.get()),
+                save_probabilities=bool(self.save_probabilities.get()),
+                save_features=bool(self.save_features.get()),
+                extension=OUTPUT_EXTENSIONS[self.output_format.get()],
+                block_rows=self.prediction_block_rows,
+                coarse_to_fine=bool(self.coarse_to_fine_var.get()),
+                coarse_to_fine_tolerance=self.coarse_to_fine_tolerance,
+                temporal=(bool(self.temporal_var.get()) and self.input_type.get() == "video"
+                          and not (self.save_probabilities.get() or self.save_features.get())),
+                temporal_threshold=self.temporal_threshold,
+            )
+        except Exception as e:
+            logging.error(f"Batch setup failed: {str(e)}")
+            messagebox.showerror("Error", f"Batch setup failed: {str(e)}")
+            return
+
+        # Each run gets its own stop event, so a stopped run still draining cannot stop the next
+        self.batch_running = True
+        self.batch_stop = threading.Event()
+        self.stop_button.config(state=tk.NORMAL)
+        self.batch_progress['maximum'] = max(1, total)
+        self.batch_progress['value'] = 0
+        self.batch_status.config(text=f"Processing {total} items...")
+        logging.info(f"Batch started: {total} items from {self.input_path}")
+
+        self.batch_thread = threading.Thread(
+            target=self._run_batch,
+            args=(frames, options, self.classifier, self._feature_config(), self.batch_workers,
+                  self.crop_coords if self.train_crop_var.get() else None, self.batch_stop),
+            daemon=True)
+        self.batch_thread.start()
+        self.root.after(100, self._poll_batch_queue)
+
+    def stop_batch_processing(self):
+        """Ask the batch pipeline to stop after the items already in flight"""
+        if self.batch_running and not self.batch_stop.is_set():
+            self.batch_stop.set()
+            self.batch_status.config(text="Stopping batch processing...")
+
+    def _run_batch(self, frames, options, classifier, config, workers, crop, stop):
+        """Run the batch pipeline on this background thread, reporting progress to the Tk thread"""
+        start_time = time.time()
+        done = failed = 0
+
+        try:
+            for item in run_batch(frames, classifier, config, options, workers, crop, should_stop=stop.is_set):
+                if "error" in item:
+                    failed += 1
+                else:
+                    done += 1
+                self.batch_queue.put(("progress", done + failed, time.time() - start_time))
+        except Exception as e:
+            logging.error(f"Batch processing failed: {str(e)}")
+        finally:
+            self.batch_queue.put(("done", done, failed, time.time() - start_time, stop.is_set()))
+
+    def _poll_batch_queue(self):
+        """Apply batch progress messages on the Tk thread"""
+        finished = False
+        try:
+            while True:
+                message = self.batch_queue.get_nowait()
+                if message[0] == "progress":
+                    _, processed, elapsed = message
+                    self.batch_progress['value'] = processed
+                    rate = processed / elapsed if elapsed > 0 else 0.0
+                    self.batch_status.config(
+                        text=f"Processed {processed}/{int(self.batch_progress['maximum'])} ({rate:.2f} items/s)")
+                else:
+                    _, done, failed, elapsed, stopped = message
+                    rate = done / elapsed if elapsed > 0 else 0.0
+                    summary = f"{done} written, {failed} failed in {elapsed:.1f}s ({rate:.2f} items/s)"
+                    self.batch_status.config(text=("Stopped: " if stopped else "Completed: ") + summary)
+                    self.status_var.set(f"Batch processing {'stopped' if stopped else 'completed'}")
+                    logging.info(f"Batch finished: {summary}")
+                    self.stop_button.config(state=tk.DISABLED)
+                    # Only now has the run drained, so a new batch may start
+                    self.batch_running = False
+                    finished = True
+        except queue.Empty:
+            pass
+
+        if not finished:
+            self.root.after(100, self._poll_batch_queue)
+
     def toggle_feature_suggestion(self):
         """Toggle feature suggestion mode"""
         if self.suggest_features_var.get():
             self.status_var.set("Feature suggestion enabled")
+            if self.classifier is not None:
+                self.suggest_feature_pruning()
         else:
             self.status_var.set("Feature suggestion disabled")
+            if self.feature_channels is not None:
+                self.feature_channels = None
+                self.pruned_selection = None
+                self.status_var.set("Full feature set restored")
+                if self.current_image is not None and self.label_mask is not None and np.any(self.label_mask > 0):
+                    self.train_classifier()
+
+    def suggest_feature_pruning(self):
+        """Offer a retrained model on the channels that carry most of the forest's importance"""
+        if self.classifier is None or self.reference_image is None or self.training_set is None:
+            self.status_var.set("Train a classifier to get feature suggestions")
+            return
+
+        try:
+            self.status_var.set("Ranking features...")
+            self.root.update()
+
+            config = self._feature_config()
+            names = self.extract_features(self.reference_image).channel_names
+            importances = self.classifier.feature_importances_
+            if len(importances) != len(names) or self.training_set.config != config:
+                raise ValueError("Feature selection changed since training, retrain first")
+
+            kept = rank_channels(names, importances, self.prune_kept_importance)
+            if len(kept) == len(names):
+                self.status_var.set("Every feature channel is in use, nothing to prune")
+                return
+
+            pruned_config = dict(config, channels=kept)
+            columns = [names.index(name) for name in kept]
+            full_accuracy, pruned_accuracy = self._holdout_accuracy(columns)
+            speedup, filters, pruned_filters = self._feature_speedup(config, pruned_config)
+
+            dropped = [name for name in names if name not in kept]
+            summary = ", ".join(dropped[:12]) + (f" and {len(dropped) - 12} more" if len(dropped) > 12 else "")
+            message = (f"Keep {len(kept)} of {len(names)} channels "
+                       f"({self.prune_kept_importance:.0%} of feature importance), "
+                       f"computing {pruned_filters} of {filters} filters.\n\n"
+                       f"Dropped: {summary}\n\n"
+                       f"Expected feature extraction speedup: {speedup:.1f}x\n"
+                       f"Held-out accuracy on labeled pixels: {full_accuracy:.1%} -> {pruned_accuracy:.1%} "
+                       f"({100 * (pruned_accuracy - full_accuracy):+.1f} points)\n\n"
+                       f"Retrain and use the pruned model?")
+            if not messagebox.askyesno("Suggested Features", message):
+                self.status_var.set("Feature suggestion declined")
+                return
+
+            with self.training_lock:
+                self.feature_channels = kept
+                self.pruned_selection = self._feature_selection()
+                self.training_set.select_channels(self._feature_config(), columns)
+                self.training_data = self.training_set.features[:self.training_set.size]
+                self.training_labels = self.training_set.labels[:self.training_set.size]
+                self.classifier = train_forest(self.training_data, self.training_labels)
+
+            self.status_var.set(f"Using pruned model on {len(kept)} of {len(names)} channels")
+
+        except Exception as e:
+            logging.error(f"Feature suggestion failed: {str(e)}")
+            messagebox.showerror("Error", f"Feature suggestion failed: {str(e)}")
+            self.status_var.set(f"Error: {str(e)}")
+
+    def _holdout_accuracy(self, columns, holdout=0.25):
+        """Accuracy of the full and the column-pruned forest on held-out labeled pixels"""
+        size = self.training_set.size
+        order = np.random.default_rng(0).permutation(size)
+        test, train = order[:int(size * holdout)], order[int(size * holdout):]
+        if len(test) == 0 or len(np.unique(self.training_labels[train])) < 2:
+            raise ValueError("Not enough labeled pixels to compare models")
+
+        accuracies = []
+        for X in (self.training_data, self.training_data[:, columns]):
+            classifier = train_forest(X[train], self.training_labels[train])
+            predicted = forest_engine(classifier).predict(X[test], self.prediction_workers)
+            accuracies.append(float(np.mean(predicted == self.training_labels[test])))
+        return tuple(accuracies)
+
+    def _feature_speedup(self, config, pruned_config, size=256):
+        """Time both feature plans on a central crop of the training image.
+
+        Returns the speedup and the number of filters each plan computes.
+        """
+        height, width = self.reference_image.shape[:2]
+        y0, x0 = max(0, (height - size) // 2), max(0, (width - size) // 2)
+        crop = self.reference_image[y0:y0 + size, x0:x0 + size]
+
+        timings = []
+        filters = []
+        for plan in (config, pruned_config):
+            start = time.perf_counter()
+            scale_space = ScaleSpace(crop, cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY))
+            compute_features(scale_space, plan)
+            timings.append(time.perf_counter() - start)
+            filters.append(len(feature_jobs(scale_space, plan)))
+        return timings[0] / max(timings[1], 1e-9), filters[0], filters[1]
 
     def toggle_live_update(self):
         """Toggle live update mode"""
         if self.live_update_var.get():
             self.status_var.set("Live update enabled")
+            if self.live_poll_id is None:
+                self._poll_live_update()
+            self.schedule_live_update()
         else:
+            self.cancel_live_update()
+            if self.live_poll_id is not None:
+                self.root.after_cancel(self.live_poll_id)
+                self.live_poll_id = None
+            self.live_labels = None
+            self.display_preview()
             self.status_var.set("Live update disabled")
 
+    def schedule_live_update(self):
+        """Restart the debounce timer for a background retrain and preview"""
+        self.cancel_live_update()
+        self.live_after_id = self.root.after(self.live_update_delay_ms, self._start_live_update)
+
+    def cancel_live_update(self):
+        """Mark any running live job as outdated and drop a pending one"""
+        self.live_generation += 1
+        if self.live_after_id is not None:
+            self.root.after_cancel(self.live_after_id)
+            self.live_after_id = None
+
+    def _start_live_update(self):
+        """Start a background retrain and proxy preview for the current labels"""
+        self.live_after_id = None
+        if self.current_image is None or self.label_mask is None or not np.any(self.label_mask > 0):
+            return
+
+        # Everything GUI-owned is read here; the worker must not touch Tk variables
+        settings = {
+            "config": self._feature_config(),
+            "max_rows_per_label": self.max_training_rows_per_label,
+            "feature_workers": self.feature_workers,
+            "prediction_workers": self.prediction_workers,
+            "proxy_size": self.live_proxy_size,
+        }
+        self.status_var.set("Live update: training...")
+        threading.Thread(target=self._live_update_worker,
+                         args=(self.live_generation, self.current_image, self.label_mask.copy(), settings),
+                         daemon=True).start()
+
+    def _live_update_worker(self, generation, img, label_mask, settings):
+        """Retrain on label changes and predict a downscaled proxy of the image off the Tk thread.
+
+        The lock is held only while the training set is updated and copied, so Train on the
+        Tk thread never waits for a background refit; the refit is kept only if no newer
+        live update or Train has started since.
+        """
+        config = settings["config"]
+        try:
+            with self.training_lock:
+                if generation != self.live_generation:
+                    return
+                changed = self.update_training_set(img, label_mask, config, settings["max_rows_per_label"],
+                                                   settings["feature_workers"])
+                classifier = self.classifier
+                if changed or classifier is None:
+                    classifier = None
+                    training_data, training_labels = self.training_data.copy(), self.training_labels.copy()
+
+            if classifier is None:
+                classifier = train_forest(training_data, training_labels)
+                with self.training_lock:
+                    if generation != self.live_generation:
+                        return
+                    self.classifier = classifier
+                    self.reference_image = img
+
+            if generation != self.live_generation:
+                return
+            # Featurize the image downscaled to the proxy size, with sigmas scaled to match
+            factor = max(img.shape[:2]) / settings["proxy_size"]
+            if factor > 1:
+                stack = coarse_features(img, config, factor, settings["feature_workers"])
+            else:
+                stack = self._cached_features(img, config,
+                                              lambda: image_features(img, config, settings["feature_workers"]))
+            if generation != self.live_generation:
+                return
+
+            predicted = forest_engine(classifier).predict(stack.data.reshape(-1, stack.num_channels),
+                                                          settings["prediction_workers"])
+            self.live_results.put((generation, predicted.reshape(stack.height, stack.width).astype(np.uint8)))
+
+        except Exception as e:
+            self.live_results.put((generation, e))
+
+    def _poll_live_update(self):
+        """Show finished live previews; runs on the Tk thread while live mode is on"""
+        try:
+            while True:
+                generation, result = self.live_results.get_nowait()
+                if generation != self.live_generation:
+                    continue
+                if isinstance(result, Exception):
+                    logging.error(f"Live update failed: {str(result)}")
+                    self.status_var.set(f"Live update error: {str(result)}")
+                    continue
+
+                height, width = self.label_mask.shape
+                self.live_labels = cv2.resize(result, (width, height), interpolation=cv2.INTER_NEAREST)
+                self.display_preview()
+                self.status_var.set("Live preview updated")
+        except queue.Empty:
+            pass
+
+        self.live_poll_id = self.root.after(100, self._poll_live_update)
+
     def add_label(self):
         """Add a new custom label"""
         label_name = simpledialog.askstring("Add Label", "Enter label name:", parent=self.root)
@@ -1564,4 +2262,8 @@ class AdvancedSegmentationApp:
             self.status_var.set(f"Added new label: {label_name}")
 
     def update_label_preview(self):
-        """Update the lab
\ No newline at end of file
+        """Update the label color preview swatch"""
+        color = self.label_colors.get(self.current_label, (255, 255, 255))
+        self.label_preview.config(bg='#%02x%02x%02x' % color)
+        self.current_label_text.config(
+            text=f"{self.label_names.get(self.current_label, 'Label')} ({self.current_label})")
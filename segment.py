@@ -0,0 +1,217 @@
+"""Command-line batch segmentation for machines without a display.
+
+Segments every image of a folder or glob pattern, or every frame of a video, with a
+model saved by the backend (a pickle holding the classifier and its feature config):
+
+    python segment.py models/cells.pkl /data/acquisition -o /data/segmented
+    python segment.py models/cells.pkl "/data/plate1/*.tif" --workers 16 --format TIFF
+    python segment.py models/cells.pkl timelapse.mp4 --temporal --frame-interval 5
+
+--config replaces the saved feature config with a JSON file holding "features",
+"sigmas" and optionally "channels". Results are written as they finish, as
+<name>_segmented.<ext> in the output folder, where files matched by a recursive glob
+keep their subdirectories in the name (a/img1.tif becomes a__img1) and the run refuses
+to start if two inputs would still share a name. Outputs that already exist are skipped
+unless --overwrite is given, so an interrupted run picks up where it stopped. A
+progress line goes to stderr and a throughput summary to stdout. The exit status is 1
+when any item failed.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from segmentation import metrics
+from segmentation.config import OUTPUT_EXTENSIONS, batch_options, feature_config
+from segmentation.features import image_features
+from segmentation.io import batch_source, input_kind, load_model, segmented_path
+from segmentation.pipeline import run_batch
+
+
+def format_duration(seconds):
+    """Render seconds as 1h02m03s, 4m18s or 12s"""
+    seconds = int(round(seconds))
+    hours, minutes, seconds = seconds // 3600, seconds // 60 % 60, seconds % 60
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    """Progress line on stderr: redrawn in place on a terminal, one line every interval seconds otherwise"""
+
+    def __init__(self, total=None, stream=sys.stderr, interval=10.0):
+        self.total = total
+        self.stream = stream
+        self.interactive = stream.isatty()
+        self.interval = interval
+        self.start = time.time()
+        self.shown = 0.0
+        self.done = self.failed = self.skipped = self.pixels = 0
+
+    def update(self, name):
+        now = time.time()
+        if not self.interactive and now - self.shown < self.interval:
+            return
+        self.shown = now
+        elapsed = now - self.start
+        finished = self.done + self.failed + self.skipped
+        rate = (self.done + self.failed) / elapsed if elapsed > 0 else 0.0
+        line = f"[{finished}/{self.total or '?'}]"
+        if self.total:
+            line += f" {finished / self.total:6.1%}"
+        line += f" {rate:.2f} items/s {self.pixels / 1e6 / elapsed if elapsed > 0 else 0.0:.1f} Mpx/s"
+        if self.total and rate > 0:
+            line += f" ETA {format_duration((self.total - finished) / rate)}"
+        if self.failed:
+            line += f" {self.failed} failed"
+        line += f" {name}"
+        if self.interactive:
+            self.stream.write(f"\r{line[:119]:<119}")
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def close(self):
+        if self.interactive:
+            self.stream.write("\n")
+            self.stream.flush()
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        processed = self.done + self.failed
+        text = f"Segmented {self.done} of {processed} items"
+        notes = [f"{self.failed} failed"] if self.failed else []
+        if self.skipped:
+            notes.append(f"{self.skipped} skipped as already done")
+        if notes:
+            text += f" ({', '.join(notes)})"
+        text += f" in {format_duration(elapsed)}"
+        if elapsed > 0 and processed:
+            text += f": {processed / elapsed:.2f} items/s, {self.pixels / 1e6 / elapsed:.1f} Mpx/s"
+        return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segment a folder, glob pattern or video with a saved model")
+    parser.add_argument("model", help="model file saved by the backend")
+    parser.add_argument("input", help="image folder, quoted glob pattern, video or single image")
+    parser.add_argument("-o", "--output", default="output", help="folder the segmentations are written to")
+    parser.add_argument("--config", help="JSON feature config to use instead of the one saved with the model")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--format", choices=sorted(OUTPUT_EXTENSIONS), default="PNG")
+    parser.add_argument("--binary", action="store_true", help="write cell/background masks instead of labels")
+    parser.add_argument("--overwrite", action="store_true", help="segment items whose output already exists")
+    parser.add_argument("--save-probabilities", action="store_true", help="also write per-class probabilities")
+    parser.add_argument("--coarse-to-fine", action="store_true",
+                        help="classify full-resolution pixels only near label boundaries")
+    parser.add_argument("--temporal", action="store_true",
+                        help="reuse labels between video frames, recomputing only changed regions")
+    parser.add_argument("--change-threshold", type=int, default=8,
+                        help="gray level change that marks a pixel as changed with --temporal")
+    parser.add_argument("--frame-interval", type=int, default=1, help="segment every n-th video frame")
+    parser.add_argument("--max-frames", type=int, help="stop after this many video frames")
+    parser.add_argument("--metrics-file", help="write Prometheus text metrics to this file every 30 s")
+    parser.add_argument("--json-logs", action="store_true", help="log one JSON object per line")
+    args = parser.parse_args()
+
+    kind = input_kind(args.input)
+    if args.workers < 1 or args.frame_interval < 1:
+        parser.error("--workers and --frame-interval must be at least 1")
+    if args.temporal and kind != "video":
+        parser.error("--temporal needs a video input")
+    if args.temporal and args.save_probabilities:
+        parser.error("--temporal cannot be combined with --save-probabilities")
+    if kind != "glob" and not os.path.exists(args.input):
+        parser.error(f"No such input: {args.input}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for handler in logging.getLogger().handlers:
+        if args.json_logs:
+            handler.setFormatter(metrics.JsonFormatter())
+        else:
+            handler.addFilter(lambda record: not hasattr(record, "metrics"))
+    if args.metrics_file:
+        metrics.registry.start_export(args.metrics_file)
+
+    try:
+        classifier, config = load_model(args.model)
+        if args.config:
+            with open(args.config) as f:
+                saved = json.load(f)
+            config = feature_config(saved["features"], saved.get("sigmas"), saved.get("channels"))
+        channels = image_features(np.zeros((16, 16, 3), dtype=np.uint8), config).num_channels
+        if channels != classifier.n_features_in_:
+            raise ValueError(f"the feature config yields {channels} channels but the model expects "
+                             f"{classifier.n_features_in_}")
+    except Exception as e:
+        logging.error(f"Could not load the model or config: {str(e)}")
+        sys.exit(1)
+
+    os.makedirs(args.output, exist_ok=True)
+    options = batch_options(
+        args.output,
+        binary=args.binary,
+        save_probabilities=args.save_probabilities,
+        extension=OUTPUT_EXTENSIONS[args.format],
+        coarse_to_fine=args.coarse_to_fine,
+        temporal=args.temporal,
+        temporal_threshold=args.change_threshold,
+    )
+
+    progress = Progress()
+
+    def skip(name):
+        if args.overwrite or not os.path.exists(segmented_path(options, name)):
+            return False
+        progress.skipped += 1
+        return True
+
+    try:
+        total, frames = batch_source(kind, args.input, skip, args.frame_interval, args.max_frames)
+    except Exception as e:
+        logging.error(f"Could not open the input: {str(e)}")
+        sys.exit(1)
+    if total == 0:
+        logging.error(f"Nothing to segment in {args.input}")
+        sys.exit(1)
+    logging.info(f"Segmenting {total} items from {args.input} into {args.output} with {args.workers} workers")
+
+    progress.total = total
+    progress.start = time.time()
+    try:
+        for item in run_batch(frames, classifier, config, options, args.workers):
+            if "error" in item:
+                progress.failed += 1
+            else:
+                progress.done += 1
+                progress.pixels += item["pixels"]
+            progress.update(item["name"])
+    except KeyboardInterrupt:
+        progress.close()
+        logging.warning("Interrupted, rerun without --overwrite to resume")
+        print(progress.summary())
+        sys.exit(130)
+    except Exception as e:
+        progress.close()
+        logging.error(f"Batch processing failed: {str(e)}")
+        print(progress.summary())
+        sys.exit(1)
+    finally:
+        metrics.registry.stop_export()
+
+    progress.close()
+    summary = progress.summary()
+    logging.info(summary)
+    print(summary)
+    sys.exit(1 if progress.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
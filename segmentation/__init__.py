@@ -0,0 +1,42 @@
+"""GUI-free segmentation core: feature extraction, training, inference and batch I/O.
+
+Everything takes plain objects: RGB uint8 arrays, feature config dicts built by
+feature_config() and batch option dicts built by batch_options(). The GUI, the HTTP
+backend, the command line and batch worker processes all import from here.
+
+Importing the package is cheap. Submodules are loaded when one of their names is first
+used, and OpenCV, SciPy, scikit-image and scikit-learn are imported only by the code
+that calls into them, so a process that never trains does not pay for scikit-learn and
+one that never builds a Gabor or Hessian feature does not pay for scikit-image.
+"""
+import importlib
+
+_EXPORTS = {
+    "config": ["DEFAULT_SIGMAS", "FEATURE_FAMILIES", "OUTPUT_EXTENSIONS", "batch_options", "feature_config"],
+    "features": ["FeatureCache", "FeatureStack", "ScaleSpace", "coarse_features", "compute_features",
+                 "feature_jobs", "feature_padding", "image_features", "rank_channels", "region_features"],
+    "training": ["TrainingSet", "make_classifier", "train_forest"],
+    "inference": ["ForestEngine", "TemporalSegmenter", "coarse_to_fine_labels", "describe_levels",
+                  "forest_engine", "labels_to_binary", "predict_labels", "predict_probabilities"],
+    "io": ["IMAGE_EXTENSIONS", "VIDEO_EXTENSIONS", "VideoFrameStore", "batch_source", "encode_batch_result",
+           "glob_root", "input_kind", "iter_folder_images", "iter_video_frames", "list_images", "load_model",
+           "preprocess_frame", "save_model", "segmented_path", "unique_names"],
+    "pipeline": ["init_batch_worker", "map_stage", "ordered_pool_stage", "run_batch", "segment_batch_item",
+                 "segment_temporal_item", "stream_pipeline", "write_batch_result"],
+}
+
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name):
+    if name in _MODULES:
+        value = getattr(importlib.import_module(f".{_MODULES[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,26 @@
+"""Deferred imports for the heavy optional dependencies of the core"""
+import importlib
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    The real module's namespace is copied in on that first access, so later lookups
+    are plain attribute reads.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_lazy_name"] = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__dict__["_lazy_name"])
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy module {self.__dict__['_lazy_name']!r}>"
+
+
+def lazy_import(name):
+    """Return a LazyModule for name, which is imported when first used"""
+    return LazyModule(name)
@@ -0,0 +1,57 @@
+"""Plain feature configs and batch options shared by the GUI, the backend and the CLI.
+
+A feature config is a JSON-serializable dict with the enabled feature family names
+under "features", the sigma values under "sigmas" and, for a pruned model, the channel
+names to keep under "channels". Batch options are a dict of the settings a batch
+worker needs, see batch_options().
+"""
+FEATURE_FAMILIES = [
+    "Gaussian Smoothing",
+    "Edge",
+    "Laplacian of Gaussian",
+    "Gaussian Gradient Magnitude",
+    "Difference of Gaussians",
+    "Texture",
+    "Structure Tensor Eigenvalues",
+    "Hessian of Gaussian Eigenvalue"
+]
+
+DEFAULT_SIGMAS = [0.3, 0.7, 1.0, 1.6, 3.5, 5.0, 10.0]
+
+OUTPUT_EXTENSIONS = {"PNG": ".png", "TIFF": ".tif", "JPG": ".jpg"}
+
+
+def feature_config(features, sigmas=None, channels=None):
+    """Build a feature config from family names, in canonical family order"""
+    unknown = set(features) - set(FEATURE_FAMILIES)
+    if unknown:
+        raise ValueError(f"Unknown feature: {sorted(unknown)[0]}")
+
+    config = {
+        "features": [family for family in FEATURE_FAMILIES if family in set(features)],
+        "sigmas": [float(sigma) for sigma in (DEFAULT_SIGMAS if sigmas is None else sigmas)],
+    }
+    if channels is not None:
+        config["channels"] = list(channels)
+    return config
+
+
+def batch_options(output_folder, **overrides):
+    """Return the batch worker settings with defaults for everything not overridden"""
+    options = {
+        "binary": False,
+        "save_probabilities": False,
+        "save_features": False,
+        "output_folder": output_folder,
+        "extension": OUTPUT_EXTENSIONS["PNG"],
+        "block_rows": 256,
+        "coarse_to_fine": False,
+        "coarse_to_fine_tolerance": 0.01,
+        "temporal": False,
+        "temporal_threshold": 8,
+    }
+    unknown = set(overrides) - set(options)
+    if unknown:
+        raise ValueError(f"Unknown batch option: {sorted(unknown)[0]}")
+    options.update(overrides)
+    return options
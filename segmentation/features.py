@@ -0,0 +1,428 @@
+"""Pixel feature extraction: Gaussian scale spaces, filter banks and the feature stack cache"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from glob import glob
+
+import numpy as np
+
+from . import metrics
+from ._lazy import lazy_import
+
+cv2 = lazy_import("cv2")
+ndi = lazy_import("scipy.ndimage")
+filters = lazy_import("skimage.filters")
+skimage_feature = lazy_import("skimage.feature")
+skimage_util = lazy_import("skimage.util")
+
+
+class FeatureStack:
+    """Contiguous (H, W, C) feature array with a channel-name index"""
+
+    def __init__(self, data, channel_names):
+        if data.ndim != 3 or data.shape[2] != len(channel_names):
+            raise ValueError("Feature data must be (H, W, C) with one name per channel")
+        self.data = np.ascontiguousarray(data, dtype=np.float32)
+        self.channel_names = list(channel_names)
+        self.channel_index = {name: i for i, name in enumerate(self.channel_names)}
+
+    @classmethod
+    def from_features(cls, features, shape):
+        """Build a stack from a dict of 2D (H, W) or 3D (H, W, K) feature arrays"""
+        height, width = shape[:2]
+        names = []
+        for name, feature_data in features.items():
+            if feature_data.ndim == 2:
+                names.append(name)
+            else:
+                names.extend(f"{name}_{k}" for k in range(feature_data.shape[2]))
+
+        data = np.empty((height, width, len(names)), dtype=np.float32)
+        channel = 0
+        for feature_data in features.values():
+            if feature_data.ndim == 2:
+                data[:, :, channel] = feature_data
+                channel += 1
+            else:
+                depth = feature_data.shape[2]
+                data[:, :, channel:channel + depth] = feature_data
+                channel += depth
+
+        return cls(data, names)
+
+    @property
+    def height(self):
+        return self.data.shape[0]
+
+    @property
+    def width(self):
+        return self.data.shape[1]
+
+    @property
+    def num_channels(self):
+        return self.data.shape[2]
+
+    def channel(self, name):
+        """Return a single (H, W) channel by name"""
+        return self.data[:, :, self.channel_index[name]]
+
+    def pixels(self, mask=None):
+        """Return an (N, C) sample matrix for all pixels or the pixels selected by a boolean mask"""
+        if mask is None:
+            return self.data.reshape(-1, self.num_channels)
+        return self.data[mask]
+
+    def rows(self, start, stop):
+        """Return an (N, C) sample matrix view of the pixels in rows [start, stop)"""
+        return self.data[start:stop].reshape(-1, self.num_channels)
+
+
+class ScaleSpace:
+    """Per-image cache of Gaussian-smoothed images keyed by sigma, derivative order and border mode.
+
+    Safe to share between feature extraction threads: each entry is computed once.
+    """
+
+    def __init__(self, source, gray):
+        self.source = source
+        self.gray = gray
+        if gray.dtype == np.uint8:
+            # Bit-identical to img_as_float, without importing scikit-image for SciPy-only configs
+            self.image = gray * (1.0 / 255)
+        else:
+            self.image = skimage_util.img_as_float(gray)
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _get(self, key, compute):
+        """Return a cached entry, computing it at most once across threads"""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._cache:
+                self._cache[key] = compute()
+        return self._cache[key]
+
+    def smooth(self, sigma, order=(0, 0), mode='nearest'):
+        """Return the Gaussian (derivative) of the image at the given sigma"""
+        key = ("gaussian", float(sigma), tuple(order), mode)
+        return self._get(key, lambda: ndi.gaussian_filter(self.image, sigma, order=order, mode=mode, truncate=4.0))
+
+    def sobel(self, axis):
+        """Return the Sobel gradient of the unsmoothed image along an axis"""
+        return self._get(("sobel", axis), lambda: filters.sobel(self.image, axis=axis))
+
+    def hessian(self, sigma):
+        """Return the (Hrr, Hrc, Hcc) finite-difference Hessian of the zero-padded smoothed image"""
+        gradients = np.gradient(self.smooth(sigma, mode='constant'))
+        return [np.gradient(gradients[0], axis=0),
+                np.gradient(gradients[0], axis=1),
+                np.gradient(gradients[1], axis=1)]
+
+
+class FeatureCache:
+    """On-disk LRU cache of memory-mapped feature stacks keyed by image content and feature configuration"""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(img, config):
+        """Hash the pixel data together with the feature configuration"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(str((img.shape, img.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(img).data)
+        digest.update(json.dumps(config, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.folder, key)
+        return base + ".npy", base + ".json"
+
+    def load(self, key):
+        """Return the cached FeatureStack for a key, memory-mapped read-only, or None"""
+        data_path, names_path = self._paths(key)
+        try:
+            with open(names_path) as f:
+                names = json.load(f)
+            data = np.load(data_path, mmap_mode='r')
+            os.utime(data_path)
+        except (OSError, ValueError):
+            self.misses += 1
+            metrics.count("cache_requests", cache="features", result="miss")
+            return None
+        self.hits += 1
+        metrics.count("cache_requests", cache="features", result="hit")
+        return FeatureStack(data, names)
+
+    def collect_metrics(self):
+        """Hit ratio gauge for the metrics registry"""
+        requests = self.hits + self.misses
+        return [("cache_hit_ratio", {"cache": "features"}, self.hits / requests if requests else 0.0)]
+
+    def store(self, key, stack):
+        """Write a stack to the cache and evict least recently used entries over the size limit"""
+        if stack.data.nbytes > self.max_bytes:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        data_path, names_path = self._paths(key)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with metrics.span("write", target="feature_cache"):
+            with open(names_path + suffix, "w") as f:
+                json.dump(stack.channel_names, f)
+            with open(data_path + suffix, "wb") as f:
+                np.save(f, stack.data)
+            os.replace(names_path + suffix, names_path)
+            os.replace(data_path + suffix, data_path)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used stacks until the cache fits within max_bytes"""
+        with self._lock:
+            entries = []
+            for path in glob(os.path.join(self.folder, "*.npy")):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                for stale in (path, path[:-len(".npy")] + ".json"):
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+                total -= size
+
+
+def _edge_feature(scale_space):
+    return np.stack([scale_space.sobel(0), scale_space.sobel(1)], axis=-1)
+
+
+def _log_feature(scale_space, sigma):
+    return filters.laplace(scale_space.smooth(sigma))
+
+
+def _ggm_feature(scale_space, sigma):
+    gx = scale_space.smooth(sigma, order=(0, 1))
+    gy = scale_space.smooth(sigma, order=(1, 0))
+    return np.sqrt(gx ** 2 + gy ** 2)
+
+
+def _dog_feature(scale_space, sigma1, sigma2):
+    return scale_space.smooth(sigma1) - scale_space.smooth(sigma2)
+
+
+def _gabor_feature(scale_space, sigma):
+    filt_real, filt_imag = filters.gabor(scale_space.gray, frequency=0.6, sigma_x=sigma, sigma_y=sigma)
+    return np.sqrt(filt_real ** 2 + filt_imag ** 2)
+
+
+def _structure_tensor_feature(scale_space):
+    gx = scale_space.sobel(0)
+    gy = scale_space.sobel(1)
+    gxx = filters.gaussian(gx * gx, sigma=1)
+    gxy = filters.gaussian(gx * gy, sigma=1)
+    gyy = filters.gaussian(gy * gy, sigma=1)
+
+    lambda1 = 0.5 * (gxx + gyy + np.sqrt((gxx - gyy) ** 2 + 4 * gxy ** 2))
+    lambda2 = 0.5 * (gxx + gyy - np.sqrt((gxx - gyy) ** 2 + 4 * gxy ** 2))
+
+    return np.stack([lambda1, lambda2], axis=-1)
+
+
+def _hessian_feature(scale_space, sigma):
+    return skimage_feature.hessian_matrix_eigvals(scale_space.hessian(sigma))[0]
+
+
+def feature_jobs(scale_space, config):
+    """Build the ordered (channel names, compute function) jobs for a feature config.
+
+    The config is a plain dict with the enabled feature family names under "features"
+    and the sigma values under "sigmas", as built by config.feature_config(). An
+    optional "channels" list restricts the stack to those channel names.
+    """
+    enabled = set(config["features"])
+    all_sigmas = config["sigmas"]
+    sigmas = [(i, sigma) for i, sigma in enumerate(all_sigmas) if sigma > 0]
+    jobs = []
+
+    # Gaussian Smoothing
+    if "Gaussian Smoothing" in enabled:
+        for i, sigma in sigmas:
+            jobs.append(([f"Gaussian_{i}"], partial(scale_space.smooth, sigma)))
+
+    # Edge detection
+    if "Edge" in enabled:
+        jobs.append((["Edge_0", "Edge_1"], partial(_edge_feature, scale_space)))
+
+    # Laplacian of Gaussian
+    if "Laplacian of Gaussian" in enabled:
+        for i, sigma in sigmas:
+            jobs.append(([f"LoG_{i}"], partial(_log_feature, scale_space, sigma)))
+
+    # Gaussian Gradient Magnitude
+    if "Gaussian Gradient Magnitude" in enabled:
+        for i, sigma in sigmas:
+            jobs.append(([f"GGM_{i}"], partial(_ggm_feature, scale_space, sigma)))
+
+    # Difference of Gaussians
+    if "Difference of Gaussians" in enabled:
+        for i in range(len(all_sigmas) - 1):
+            sigma1 = all_sigmas[i]
+            sigma2 = all_sigmas[i + 1]
+            if sigma1 > 0 and sigma2 > 0:
+                jobs.append(([f"DoG_{i}"], partial(_dog_feature, scale_space, sigma1, sigma2)))
+
+    # Texture features
+    if "Texture" in enabled:
+        for i, sigma in sigmas:
+            jobs.append(([f"Gabor_{i}"], partial(_gabor_feature, scale_space, sigma)))
+
+    # Structure Tensor Eigenvalues
+    if "Structure Tensor Eigenvalues" in enabled:
+        jobs.append((["Structure Tensor_0", "Structure Tensor_1"],
+                     partial(_structure_tensor_feature, scale_space)))
+
+    # Hessian of Gaussian Eigenvalue
+    if "Hessian of Gaussian Eigenvalue" in enabled:
+        for i, sigma in sigmas:
+            jobs.append(([f"Hessian_{i}"], partial(_hessian_feature, scale_space, sigma)))
+
+    # A pruned config lists the channels to keep; filters feeding none of them are skipped
+    if config.get("channels") is not None:
+        kept = set(config["channels"])
+        jobs = [(names, compute) for names, compute in jobs if kept.intersection(names)]
+
+    return jobs
+
+
+def feature_padding(config):
+    """Return a margin wide enough to cover every configured filter's support"""
+    sigmas = [sigma for sigma in config["sigmas"] if sigma > 0]
+    return int(np.ceil(4.0 * max(sigmas, default=1.0))) + 8
+
+
+def rank_channels(names, importances, kept_importance=0.95):
+    """Return the most important channels covering kept_importance of the total, in stack order"""
+    importances = np.asarray(importances, dtype=np.float64)
+    order = np.argsort(importances)[::-1]
+    cumulative = np.cumsum(importances[order])
+    count = int(np.searchsorted(cumulative, kept_importance * cumulative[-1])) + 1
+    kept = set(order[:count].tolist())
+    return [name for i, name in enumerate(names) if i in kept]
+
+
+def compute_features(scale_space, config, workers=1):
+    """Run the configured feature jobs into a preallocated FeatureStack.
+
+    Jobs run on a thread pool when workers > 1; each writes its own channel slice, so
+    channel order does not depend on completion order.
+    """
+    jobs = feature_jobs(scale_space, config)
+    kept = config.get("channels")
+    height, width = scale_space.gray.shape
+
+    names = []
+    tasks = []
+    for job_names, compute in jobs:
+        selected = [i for i, name in enumerate(job_names) if kept is None or name in kept]
+        tasks.append((len(names), len(job_names), selected, compute, job_names[0].rsplit("_", 1)[0]))
+        names.extend(job_names[i] for i in selected)
+    data = np.empty((height, width, len(names)), dtype=np.float32)
+
+    def run_job(start, depth, selected, compute, family):
+        with metrics.span("features", family=family):
+            block = compute().reshape(height, width, depth)
+        if len(selected) < depth:
+            block = block[:, :, selected]
+        data[:, :, start:start + len(selected)] = block
+
+    workers = max(1, int(workers))
+    if workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            run_job(*task)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(run_job, *task) for task in tasks]:
+                future.result()
+
+    return FeatureStack(data, names)
+
+
+def image_features(img, config, workers=1):
+    """Featurize a whole RGB image"""
+    return compute_features(ScaleSpace(img, cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)), config, workers)
+
+
+def region_features(img, config, region, workers=1):
+    """Featurize a (y0, y1, x0, x1) window of an RGB image from a crop padded by the filter support.
+
+    The padding covers every configured filter, so the values match the full-image stack.
+    """
+    y0, y1, x0, x1 = region
+    height, width = img.shape[:2]
+    pad = feature_padding(config)
+    py0, py1 = max(0, y0 - pad), min(height, y1 + pad)
+    px0, px1 = max(0, x0 - pad), min(width, x1 + pad)
+
+    stack = image_features(img[py0:py1, px0:px1], config, workers)
+    return FeatureStack(stack.data[y0 - py0:y1 - py0, x0 - px0:x1 - px0], stack.channel_names)
+
+
+# Power of the downsampling factor by which each family's responses shrink on a downsampled
+# image: first derivatives by the factor, second derivatives by its square
+DERIVATIVE_ORDERS = {"Edge": 1, "GGM": 1, "LoG": 2, "Hessian": 2, "Structure Tensor": 2}
+
+
+def coarse_features(img, config, factor, workers=1):
+    """Featurize an image downsampled by factor, with sigmas and derivative magnitudes rescaled to full resolution"""
+    height, width = img.shape[:2]
+    size = (max(1, round(width / factor)), max(1, round(height / factor)))
+    small = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    scaled = dict(config, sigmas=[sigma / factor for sigma in config["sigmas"]])
+    stack = image_features(small, scaled, workers)
+
+    for i, name in enumerate(stack.channel_names):
+        order = DERIVATIVE_ORDERS.get(name.rsplit("_", 1)[0], 0)
+        if order:
+            stack.data[:, :, i] /= factor ** order
+    return stack
+
+
+def channel_sigma(name, sigmas):
+    """Return the widest sigma a channel is computed with, 0 for the unsmoothed Sobel-based ones"""
+    family, _, index = name.rpartition("_")
+    if family in ("Edge", "Structure Tensor"):
+        return 0.0
+    index = int(index)
+    return sigmas[index + 1] if family == "DoG" else sigmas[index]
+
+
+def sample_coarse(stack, ys, xs, factor):
+    """Bilinearly sample a stack computed at 1/factor scale at full-resolution pixel centres"""
+    fy = np.clip((ys + 0.5) / factor - 0.5, 0, stack.height - 1)
+    fx = np.clip((xs + 0.5) / factor - 0.5, 0, stack.width - 1)
+    y0 = fy.astype(np.intp)
+    x0 = fx.astype(np.intp)
+    y1 = np.minimum(y0 + 1, stack.height - 1)
+    x1 = np.minimum(x0 + 1, stack.width - 1)
+    wy = (fy - y0).astype(np.float32)[:, None]
+    wx = (fx - x0).astype(np.float32)[:, None]
+
+    data = stack.data
+    top = data[y0, x0] * (1 - wx) + data[y0, x1] * wx
+    bottom = data[y1, x0] * (1 - wx) + data[y1, x1] * wx
+    return top * (1 - wy) + bottom * wy
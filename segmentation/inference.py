@@ -0,0 +1,332 @@
+"""Random forest inference: full-image, coarse-to-fine and temporal segmentation"""
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import metrics
+from ._lazy import lazy_import
+from .features import channel_sigma, coarse_features, feature_padding, image_features, region_features, sample_coarse
+
+cv2 = lazy_import("cv2")
+
+
+class ForestEngine:
+    """Random forest inference over flat per-node leaf tables.
+
+    Each tree's class probabilities are normalized once into a flat (nodes, classes)
+    table, so a chunk of pixels costs one compiled traversal (Tree.apply, which releases
+    the GIL), one gather and one add per tree. Chunks can run on several threads.
+
+    Every chunk walks all the trees again, so deep forests need long chunks to amortize
+    pulling their nodes through the cache: by default chunks hold 8 rows per node of the
+    average tree, between 8192 and 262144 rows, split further only to give every worker
+    a chunk. Probabilities are summed in tree order exactly as predict_proba does, so
+    labels and probabilities match the classifier bit for bit.
+    """
+
+    def __init__(self, classifier, chunk_rows=None):
+        if classifier.n_outputs_ != 1:
+            raise ValueError("Only single-output forests are supported")
+
+        self.estimators = classifier.estimators_
+        self.classes_ = classifier.classes_
+        self.trees = [estimator.tree_ for estimator in self.estimators]
+        self.node_offsets = np.cumsum([0] + [tree.node_count for tree in self.trees])
+        if chunk_rows is None:
+            chunk_rows = int(np.clip(8 * self.node_offsets[-1] / len(self.trees), 8192, 262144))
+        self.chunk_rows = chunk_rows
+
+        values = np.concatenate([tree.value[:, 0, :len(self.classes_)] for tree in self.trees]).astype(np.float64)
+        totals = values.sum(axis=1, keepdims=True)
+        totals[totals == 0.0] = 1.0
+        self.leaf_values = values / totals
+        self.tree_values = np.split(self.leaf_values, self.node_offsets[1:-1])
+
+    def _chunk_proba(self, X, out):
+        out.fill(0.0)
+        for tree, values in zip(self.trees, self.tree_values):
+            out += np.take(values, tree.apply(X), axis=0)
+        out /= len(self.trees)
+
+    def predict_proba(self, X, workers=1):
+        """Class probabilities for the rows of X, split into chunks across worker threads"""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        out = np.empty((len(X), len(self.classes_)), dtype=np.float64)
+        rows = min(self.chunk_rows, max(8192, -(-len(X) // max(1, workers))))
+        chunks = [(start, min(start + rows, len(X))) for start in range(0, len(X), rows)]
+
+        with metrics.span("predict"):
+            if workers <= 1 or len(chunks) <= 1:
+                for start, stop in chunks:
+                    self._chunk_proba(X[start:stop], out[start:stop])
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    for future in [pool.submit(self._chunk_proba, X[start:stop], out[start:stop])
+                                   for start, stop in chunks]:
+                        future.result()
+        metrics.count("predicted_pixels", len(X))
+
+        return out
+
+    def predict(self, X, workers=1):
+        """Class labels for the rows of X"""
+        return self.classes_.take(np.argmax(self.predict_proba(X, workers), axis=1), axis=0)
+
+
+_forest_engines = weakref.WeakKeyDictionary()
+
+
+def forest_engine(classifier):
+    """Return the ForestEngine for a fitted forest, rebuilding it only after a refit"""
+    engine = _forest_engines.get(classifier)
+    if engine is None or engine.estimators is not classifier.estimators_:
+        engine = ForestEngine(classifier)
+        _forest_engines[classifier] = engine
+    return engine
+
+
+def predict_labels(classifier, stack, block_rows=256, progress_callback=None, workers=1):
+    """Predict a uint8 label image from a FeatureStack in fixed-size row blocks"""
+    engine = forest_engine(classifier)
+    height, width = stack.height, stack.width
+    block_rows = max(1, int(block_rows))
+    labels = np.empty((height, width), dtype=np.uint8)
+
+    for start in range(0, height, block_rows):
+        stop = min(start + block_rows, height)
+        labels[start:stop] = engine.predict(stack.rows(start, stop), workers).reshape(stop - start, width)
+        if progress_callback is not None:
+            progress_callback(stop / height)
+
+    return labels
+
+
+def predict_probabilities(classifier, stack, block_rows=256, workers=1):
+    """Predict per-class float16 probabilities from a FeatureStack in fixed-size row blocks"""
+    engine = forest_engine(classifier)
+    height, width = stack.height, stack.width
+    block_rows = max(1, int(block_rows))
+    probabilities = np.empty((height, width, len(engine.classes_)), dtype=np.float16)
+
+    for start in range(0, height, block_rows):
+        stop = min(start + block_rows, height)
+        block = engine.predict_proba(stack.rows(start, stop), workers)
+        probabilities[start:stop] = block.reshape(stop - start, width, -1)
+
+    return probabilities
+
+
+def mask_windows(mask, tile):
+    """Yield (y0, y1, x0, x1) windows covering every set pixel of a mask.
+
+    Windows are tile rows high and span runs of adjacent tiles holding set pixels, so
+    neighbouring tiles share the padding of one featurized crop.
+    """
+    height, width = mask.shape
+    touched = np.zeros((-(-height // tile), -(-width // tile)), dtype=bool)
+    ys, xs = np.nonzero(mask)
+    touched[ys // tile, xs // tile] = True
+    for row, tiles in enumerate(touched):
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], tiles.astype(np.int8), [0]])))
+        for start, stop in zip(edges[::2], edges[1::2]):
+            yield row * tile, min((row + 1) * tile, height), start * tile, min(stop * tile, width)
+
+
+def uncertain_band(labels, unsure, radius):
+    """Mark pixels within radius of a label boundary or of a low-margin pixel"""
+    band = unsure.astype(np.uint8)
+    vertical = labels[:-1] != labels[1:]
+    horizontal = labels[:, :-1] != labels[:, 1:]
+    band[:-1] |= vertical
+    band[1:] |= vertical
+    band[:, :-1] |= horizontal
+    band[:, 1:] |= horizontal
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    return cv2.dilate(band, kernel).astype(bool)
+
+
+def _classify_pixels(engine, X, workers):
+    """Return labels and top-two probability margins for feature rows"""
+    proba = engine.predict_proba(X, workers)
+    labels = engine.classes_.take(np.argmax(proba, axis=1), axis=0).astype(np.uint8)
+    if proba.shape[1] < 2:
+        return labels, np.ones(len(X))
+    top = np.partition(proba, proba.shape[1] - 2, axis=1)
+    return labels, top[:, -1] - top[:, -2]
+
+
+def coarse_to_fine_labels(classifier, img, config, factors=(4, 1), band=2, margin=0.3, tile=64,
+                          reuse_scale=2.0, check_tiles=4, check_size=64, tolerance=0.01, workers=1, seed=0,
+                          min_coarse_tiles=4):
+    """Segment an RGB image coarse to fine, classifying full-resolution pixels only near boundaries.
+
+    The first level classifies every pixel of the image downsampled by factors[0]. Each
+    later level upsamples the labels and reclassifies only the band within band pixels
+    (plus the upsampling ratio) of a label boundary or of a pixel whose top-two class
+    probabilities differ by less than margin. Coarse levels featurize the whole
+    downsampled image. The full-resolution level featurizes tile-sized windows around
+    the band, computing channels with sigma >= reuse_scale * the previous factor by
+    bilinear sampling of the previous level's stack, so the crops need only the padding
+    of the narrow filters.
+
+    The result is checked against full-resolution prediction on check_tiles random
+    check_size windows; above tolerance disagreement the whole image is segmented at full
+    resolution instead. Images whose coarsest level would cover fewer than min_coarse_tiles
+    tiles are segmented at full resolution directly, since the band and the check cost
+    more than they save there. Returns (labels, report) where report["levels"] lists the
+    pixels classified and featurized per level.
+    """
+    engine = forest_engine(classifier)
+    height, width = img.shape[:2]
+    factors = sorted({int(factor) for factor in factors if factor >= 1} | {1}, reverse=True)
+    coarse_pixels = max(1, round(height / factors[0])) * max(1, round(width / factors[0]))
+    if len(factors) == 1 or coarse_pixels < min_coarse_tiles * tile * tile:
+        full = image_features(img, config, workers)
+        level = {"factor": 1, "pixels": height * width, "classified": height * width, "featurized": height * width}
+        report = {"levels": [level], "checked_pixels": 0, "disagreement": 0.0, "fallback": False}
+        return predict_labels(classifier, full, workers=workers), report
+    levels = []
+    labels = unsure = stack = None
+
+    for level, factor in enumerate(factors):
+        shape = (max(1, round(height / factor)), max(1, round(width / factor)))
+        if labels is None:
+            todo = np.ones(shape, dtype=bool)
+            labels = np.zeros(shape, dtype=np.uint8)
+        else:
+            ratio = int(np.ceil(factors[level - 1] / factor))
+            labels = cv2.resize(labels, shape[::-1], interpolation=cv2.INTER_NEAREST)
+            unsure = cv2.resize(unsure.astype(np.uint8), shape[::-1], interpolation=cv2.INTER_NEAREST)
+            todo = uncertain_band(labels, unsure, ratio + band)
+        unsure = np.zeros(shape, dtype=bool)
+        featurized = 0
+
+        if factor > 1:
+            stack = coarse_features(img, config, factor, workers)
+            featurized = stack.height * stack.width
+            ys, xs = np.nonzero(todo)
+            if ys.size:
+                labels[ys, xs], pixel_margin = _classify_pixels(engine, stack.data[ys, xs], workers)
+                unsure[ys, xs] = pixel_margin < margin
+        else:
+            # Channels as wide as the previous level's pixels come from its stack; the rest are exact
+            coarse_factor = factors[level - 1]
+            reuse_sigma = reuse_scale * coarse_factor
+            names = stack.channel_names
+            reused = [i for i, name in enumerate(names) if channel_sigma(name, config["sigmas"]) >= reuse_sigma]
+            exact = [i for i in range(len(names)) if i not in reused]
+            fine_config = dict(config, sigmas=[sigma if sigma < reuse_sigma else 0 for sigma in config["sigmas"]],
+                               channels=[names[i] for i in exact])
+
+            for y0, y1, x0, x1 in mask_windows(todo, tile):
+                ys, xs = np.nonzero(todo[y0:y1, x0:x1])
+                X = np.empty((ys.size, len(names)), dtype=np.float32)
+                if exact:
+                    X[:, exact] = region_features(img, fine_config, (y0, y1, x0, x1), workers).data[ys, xs]
+                    featurized += (y1 - y0) * (x1 - x0)
+                if reused:
+                    X[:, reused] = sample_coarse(stack, y0 + ys, x0 + xs, coarse_factor)[:, reused]
+                labels[y0 + ys, x0 + xs] = _classify_pixels(engine, X, workers)[0]
+
+        levels.append({"factor": factor, "pixels": shape[0] * shape[1], "classified": int(todo.sum()),
+                       "featurized": int(featurized)})
+
+    report = {"levels": levels, "checked_pixels": 0, "disagreement": 0.0, "fallback": False}
+    if check_tiles and len(factors) > 1:
+        rng = np.random.default_rng(seed)
+        size_y, size_x = min(check_size, height), min(check_size, width)
+        mismatched = 0
+        for _ in range(check_tiles):
+            y0 = int(rng.integers(0, height - size_y + 1))
+            x0 = int(rng.integers(0, width - size_x + 1))
+            window = region_features(img, config, (y0, y0 + size_y, x0, x0 + size_x), workers)
+            expected = engine.predict(window.pixels(), workers).reshape(size_y, size_x)
+            mismatched += int(np.count_nonzero(expected != labels[y0:y0 + size_y, x0:x0 + size_x]))
+        report["checked_pixels"] = check_tiles * size_y * size_x
+        report["disagreement"] = mismatched / report["checked_pixels"]
+
+        if report["disagreement"] > tolerance:
+            report["fallback"] = True
+            full = image_features(img, config, workers)
+            labels = predict_labels(classifier, full, workers=workers)
+            levels.append({"factor": 1, "pixels": height * width, "classified": height * width,
+                           "featurized": height * width})
+
+    return labels, report
+
+
+def describe_levels(report):
+    """Summarize a coarse-to-fine report as per-level classified pixel counts"""
+    parts = [f"1/{level['factor']}: {level['classified']:,} px" for level in report["levels"]]
+    summary = ", ".join(parts)
+    if report["fallback"]:
+        summary += f" (fell back to full resolution, {100 * report['disagreement']:.2f}% disagreement)"
+    return summary
+
+
+class TemporalSegmenter:
+    """Segments a frame sequence, reclassifying only pixels whose features can have changed.
+
+    Each frame is diffed against the lightly smoothed gray values the current labels were
+    computed from. Pixels that moved by more than threshold gray levels, dilated by the
+    widest filter's support, are featurized and classified again in tile windows; all
+    other labels are carried over. Reference values are updated only where a change was
+    detected, so slow drift still triggers recomputation once it exceeds the threshold.
+    When more than full_fraction of the frame is affected it is segmented whole.
+    """
+
+    def __init__(self, classifier, config, threshold=8, tile=64, full_fraction=0.5, block_rows=256, workers=1):
+        self.classifier = classifier
+        self.config = config
+        self.threshold = threshold
+        self.tile = tile
+        self.full_fraction = full_fraction
+        self.block_rows = block_rows
+        self.workers = workers
+        self.radius = feature_padding(config)
+        self.reference = None
+        self.labels = None
+
+    def reset(self):
+        """Forget the previous frame, so the next one is segmented whole"""
+        self.reference = None
+        self.labels = None
+
+    def segment(self, img):
+        """Return (labels, fraction of pixels recomputed) for the next RGB frame"""
+        gray = cv2.blur(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), (3, 3))
+        if self.labels is None or self.reference.shape != gray.shape:
+            changed = dirty = np.ones(gray.shape, dtype=bool)
+        else:
+            changed = cv2.absdiff(gray, self.reference) > self.threshold
+            if not changed.any():
+                return self.labels.copy(), 0.0
+            size = 2 * self.radius + 1
+            dirty = cv2.dilate(changed.view(np.uint8), cv2.getStructuringElement(cv2.MORPH_RECT, (size, size)))
+            dirty = dirty.view(bool)
+
+        fraction = float(np.count_nonzero(dirty)) / dirty.size
+        if self.labels is None or fraction > self.full_fraction:
+            stack = image_features(img, self.config, self.workers)
+            self.labels = predict_labels(self.classifier, stack, self.block_rows, workers=self.workers)
+            self.reference = gray
+            return self.labels.copy(), 1.0
+
+        engine = forest_engine(self.classifier)
+        for y0, y1, x0, x1 in mask_windows(dirty, self.tile):
+            ys, xs = np.nonzero(dirty[y0:y1, x0:x1])
+            stack = region_features(img, self.config, (y0, y1, x0, x1), self.workers)
+            self.labels[y0 + ys, x0 + xs] = engine.predict(stack.data[ys, xs], self.workers)
+        self.reference[changed] = gray[changed]
+        return self.labels.copy(), fraction
+
+
+def labels_to_binary(segmented):
+    """Map cell, nucleus and membrane labels to 255 and everything else to 0"""
+    binary_mask = np.zeros_like(segmented)
+    binary_mask[segmented == 1] = 255
+    binary_mask[segmented == 2] = 0
+    binary_mask[segmented == 3] = 255
+    binary_mask[segmented == 4] = 255
+    return binary_mask
@@ -0,0 +1,290 @@
+"""Image and video decoding, result encoding and saved models"""
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from glob import glob
+
+import numpy as np
+
+from . import metrics
+from ._lazy import lazy_import
+
+cv2 = lazy_import("cv2")
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+
+def save_model(path, classifier, config):
+    """Atomically write a trained classifier and its feature config to a pickle file"""
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump({"classifier": classifier, "config": config}, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_model(path):
+    """Return the (classifier, feature config) saved by save_model"""
+    with open(path, "rb") as f:
+        saved = pickle.load(f)
+    if not isinstance(saved, dict) or "classifier" not in saved or "config" not in saved:
+        raise ValueError(f"{path} is not a saved segmentation model")
+    return saved["classifier"], saved["config"]
+
+
+def list_images(folder):
+    """Return the sorted image file names in a folder"""
+    return sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def input_kind(path):
+    """Classify an input path as a folder, glob (a wildcard pattern), video or image"""
+    if os.path.isdir(path):
+        return "folder"
+    if any(char in path for char in "*?["):
+        return "glob"
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        return "video"
+    return "image"
+
+
+def batch_source(kind, path, skip=None, frame_interval=1, max_frames=None):
+    """Return (total, iterator of (name, BGR array)) for a folder, glob pattern, video or single image.
+
+    Items are named after their file without extension, or frame_NNNN for video frames.
+    Glob matches keep their path below the pattern's wildcard-free root, with directories
+    joined by "__", so a/img1.tif and b/img1.tif stay apart. Raises ValueError when two
+    files would still share a name. skip(name) rejects an item before it is decoded.
+    """
+    if kind == "folder":
+        files = list_images(path)
+        return len(files), iter_folder_images(path, files, skip, unique_names(files))
+
+    if kind == "glob":
+        files = sorted(f for f in glob(path, recursive=True) if f.lower().endswith(IMAGE_EXTENSIONS))
+        return len(files), iter_folder_images("", files, skip, unique_names(files, glob_root(path)))
+
+    if kind == "video":
+        cap = cv2.VideoCapture(path)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        total = -(-frame_count // frame_interval)
+        if max_frames is not None:
+            total = min(max_frames, total)
+        frames = iter_video_frames(path, frame_interval, max_frames,
+                                   skip=None if skip is None else lambda n: skip(f"frame_{n:04d}"))
+        return total, ((f"frame_{n:04d}", frame) for n, frame in frames)
+
+    folder, filename = os.path.split(path)
+    return 1, iter_folder_images(folder, [filename], skip)
+
+
+def glob_root(pattern):
+    """Return the leading directories of a glob pattern that hold no wildcard"""
+    root = os.path.dirname(pattern)
+    while any(char in root for char in "*?["):
+        root = os.path.dirname(root)
+    return root
+
+
+def unique_names(files, root=""):
+    """Name files by their path below root without extension, failing when two names collide"""
+    names = {}
+    for filename in files:
+        name = os.path.splitext(os.path.relpath(filename, root) if root else filename)[0]
+        name = name.replace(os.sep, "__")
+        if name in names:
+            raise ValueError(f"{names[name]} and {filename} would both be written as {name}")
+        names[name] = filename
+    return list(names)
+
+
+def segmented_path(options, name):
+    """Return where a batch writes the segmentation of the item called name"""
+    return os.path.join(options["output_folder"], f"{name}_segmented{options['extension']}")
+
+
+def iter_folder_images(folder, files, skip=None, names=None):
+    """Decode images from a folder as (name, BGR array), named by basename unless names is given"""
+    if names is None:
+        names = [os.path.splitext(os.path.basename(filename))[0] for filename in files]
+    for filename, name in zip(files, names):
+        if skip is not None and skip(name):
+            continue
+        with metrics.span("decode", source="image"):
+            img = cv2.imread(os.path.join(folder, filename))
+        if img is None:
+            logging.error(f"Failed to load image {filename}")
+            continue
+        yield name, img
+
+
+def iter_video_frames(path, frame_interval=1, max_frames=None, skip=None):
+    """Decode every frame_interval-th video frame as (frame number, BGR array).
+
+    Frames in between, and kept frames rejected by skip(frame_number), are only grabbed,
+    never decoded into images. With max_frames=None the whole video is streamed.
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError("Failed to open video")
+
+    try:
+        frame_count = 0
+        frames_loaded = 0
+        while max_frames is None or frames_loaded < max_frames:
+            if not cap.grab():
+                break
+
+            if frame_count % frame_interval == 0:
+                frames_loaded += 1
+                if skip is None or not skip(frame_count):
+                    with metrics.span("decode", source="video"):
+                        ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    yield frame_count, frame
+
+            frame_count += 1
+    finally:
+        cap.release()
+
+
+def preprocess_frame(img, crop=None):
+    """Convert a decoded BGR frame to RGB, optionally cropped to (x1, y1, x2, y2)"""
+    with metrics.span("preprocess"):
+        if crop is not None:
+            x1, y1, x2, y2 = crop
+            img = img[y1:y2, x1:x2]
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+class VideoFrameStore:
+    """Lazy, seekable view of every frame_interval-th video frame.
+
+    Only a compact (frame number, timestamp) index is built up front. Frames are decoded
+    on demand, seeking with CAP_PROP_POS_FRAMES unless the target is just ahead of the
+    read position, and kept in a memory-capped LRU. prefetch() decodes the neighbours of
+    a position on a background thread. Indexing returns the same
+    (frame number, RGB frame, file name, timestamp) tuples as the old eager list.
+    """
+
+    def __init__(self, path, frame_interval=1, max_frames=None, max_cache_bytes=512 * 1024 ** 2):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise ValueError("Failed to open video")
+
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_numbers = np.arange(0, frame_count, max(1, frame_interval), dtype=np.int64)
+        if max_frames is not None:
+            self.frame_numbers = self.frame_numbers[:max_frames]
+        self.timestamps = self.frame_numbers / fps if fps > 0 else np.zeros(len(self.frame_numbers))
+
+        self.max_cache_bytes = max_cache_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._position = 0
+        self._lock = threading.Lock()
+        self._prefetch_request = None
+        self._prefetch_ready = threading.Condition()
+        self._closed = False
+        self._prefetch_thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+        self._prefetch_thread.start()
+
+    def __len__(self):
+        return len(self.frame_numbers)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        frame_number = int(self.frame_numbers[index])
+        return frame_number, self.frame(index), f"frame_{frame_number:04d}.png", float(self.timestamps[index])
+
+    def frame(self, index):
+        """Return the read-only RGB frame at an index, decoding it if it is not cached"""
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return self._cache[index]
+
+            frame = self._decode(int(self.frame_numbers[index]))
+            self._cache[index] = frame
+            self._cache_bytes += frame.nbytes
+            while self._cache_bytes > self.max_cache_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted.nbytes
+            return frame
+
+    def _decode(self, frame_number):
+        """Decode one frame, grabbing forward for short hops and seeking otherwise"""
+        if not 0 <= frame_number - self._position <= 16:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+            self._position = frame_number
+        while self._position < frame_number:
+            self.cap.grab()
+            self._position += 1
+
+        with metrics.span("decode", source="video"):
+            ret, frame = self.cap.read()
+        if not ret:
+            raise ValueError(f"Failed to decode frame {frame_number}")
+        self._position = frame_number + 1
+
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        frame.flags.writeable = False
+        return frame
+
+    def prefetch(self, index, radius=4):
+        """Decode the frames around index in the background, nearest first"""
+        with self._prefetch_ready:
+            self._prefetch_request = (index, radius)
+            self._prefetch_ready.notify()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._prefetch_ready:
+                while self._prefetch_request is None and not self._closed:
+                    self._prefetch_ready.wait()
+                if self._closed:
+                    return
+                index, radius = self._prefetch_request
+                self._prefetch_request = None
+
+            for offset in sorted(range(-radius, radius + 1), key=abs):
+                target = index + offset
+                if self._prefetch_request is not None or self._closed:
+                    break
+                if 0 <= target < len(self) and target not in self._cache:
+                    try:
+                        self.frame(target)
+                    except ValueError as e:
+                        logging.error(f"Frame prefetch failed: {str(e)}")
+
+    def close(self):
+        """Stop prefetching and release the video"""
+        with self._prefetch_ready:
+            self._closed = True
+            self._prefetch_ready.notify()
+        self._prefetch_thread.join()
+        with self._lock:
+            self.cap.release()
+            self._cache.clear()
+            self._cache_bytes = 0
+
+
+def encode_batch_result(result, extension):
+    """Encode a segmentation result to image file bytes"""
+    if "error" not in result:
+        with metrics.span("encode"):
+            ok, encoded = cv2.imencode(extension, result.pop("segmented"))
+        if not ok:
+            result["error"] = f"could not encode {extension}"
+        else:
+            result["encoded"] = encoded
+    return result
@@ -0,0 +1,254 @@
+"""Timing spans, counters and gauges, exported as JSON log records and Prometheus text.
+
+Instrumented code records into the module-level registry:
+
+    with metrics.span("features", family="LoG"):
+        ...
+    metrics.count("feature_cache_requests", result="hit")
+    metrics.gauge("batch_items_per_second", rate)
+
+A span costs two clock reads and a locked dict update, so instrumentation stays on.
+start_export() writes the registry every interval seconds to a Prometheus text file
+(for node_exporter's textfile collector or any local scraper) and logs it as one
+structured record on the "segmentation.metrics" logger; with that logger at DEBUG every
+span is also logged as it ends. Worker processes take() their registry and ship it back
+with their results, where merge() folds it into the parent's.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+PREFIX = "segmentation"
+
+logger = logging.getLogger("segmentation.metrics")
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Span:
+    """Times a block and records its duration under a stage name"""
+
+    __slots__ = ("registry", "stage", "labels", "start")
+
+    def __init__(self, registry, stage, labels):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        self.registry.observe("stage_seconds", seconds, stage=self.stage, **self.labels)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span", extra={"span": dict(self.labels, stage=self.stage, seconds=seconds)})
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and (count, sum, max) summaries"""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+        self._export_stop = None
+        self._export_thread = None
+        self._exported = None
+
+    def span(self, stage, **labels):
+        """Context manager recording the duration of a block as stage_seconds{stage=...}"""
+        return Span(self, stage, labels)
+
+    def observe(self, name, value, **labels):
+        """Add a value to a summary"""
+        key = _key(name, labels)
+        with self._lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                self.summaries[key] = [1, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                if value > summary[2]:
+                    summary[2] = value
+
+    def count(self, name, value=1, **labels):
+        """Increase a counter"""
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        """Set a gauge to its current value"""
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def add_collector(self, collect):
+        """Register collect(), returning (name, labels, value) gauges, to be read at every export"""
+        with self._lock:
+            self.collectors.append(collect)
+
+    def remove_collector(self, collect):
+        with self._lock:
+            if collect in self.collectors:
+                self.collectors.remove(collect)
+
+    def take(self):
+        """Return and reset the counters and summaries, for shipping to another process"""
+        with self._lock:
+            taken = {"counters": list(self.counters.items()), "summaries": list(self.summaries.items())}
+            self.counters = {}
+            self.summaries = {}
+        return taken
+
+    def merge(self, taken):
+        """Fold counters and summaries returned by take() in another process into this registry"""
+        with self._lock:
+            for key, value in taken["counters"]:
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (count, total, peak) in taken["summaries"]:
+                summary = self.summaries.setdefault(key, [0, 0.0, peak])
+                summary[0] += count
+                summary[1] += total
+                summary[2] = max(summary[2], peak)
+
+    def _collected(self, gauges, collectors):
+        for collect in collectors:
+            try:
+                for name, labels, value in collect():
+                    gauges[_key(name, labels)] = value
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+        return gauges
+
+    def snapshot(self):
+        """Return every metric as a JSON-ready list of {name, labels, ...} records"""
+        with self._lock:
+            counters = dict(self.counters)
+            summaries = {key: list(value) for key, value in self.summaries.items()}
+            gauges = dict(self.gauges)
+            collectors = list(self.collectors)
+        gauges = self._collected(gauges, collectors)
+
+        records = []
+        for (name, labels), value in sorted(counters.items()):
+            records.append({"name": name, "labels": dict(labels), "type": "counter", "value": value})
+        for (name, labels), value in sorted(gauges.items()):
+            records.append({"name": name, "labels": dict(labels), "type": "gauge", "value": value})
+        for (name, labels), (count, total, peak) in sorted(summaries.items()):
+            records.append({"name": name, "labels": dict(labels), "type": "summary",
+                            "count": count, "sum": total, "max": peak})
+        return records
+
+    def prometheus_text(self):
+        """Render the registry in the Prometheus text exposition format"""
+        # Samples of one metric family must be contiguous, under a single TYPE line
+        families = {}
+
+        def add(family, kind, sample):
+            families.setdefault(family, (kind, []))[1].append(sample)
+
+        for record in self.snapshot():
+            name = f"{PREFIX}_{record['name']}"
+            labels = _format_labels(tuple(record["labels"].items()))
+            if record["type"] == "counter":
+                add(f"{name}_total", "counter", f"{name}_total{labels} {record['value']}")
+            elif record["type"] == "gauge":
+                add(name, "gauge", f"{name}{labels} {record['value']}")
+            else:
+                add(name, "summary", f"{name}_count{labels} {record['count']}")
+                add(name, "summary", f"{name}_sum{labels} {record['sum']:.6f}")
+                add(f"{name}_max", "gauge", f"{name}_max{labels} {record['max']:.6f}")
+
+        lines = []
+        for family, (kind, samples) in families.items():
+            lines.append(f"# TYPE {family} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Atomically replace a Prometheus text file with the current registry"""
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp, path)
+
+    def export(self, path=None):
+        """Write the text file and log the registry as one structured record if it changed"""
+        records = self.snapshot()
+        if path:
+            try:
+                self.write_textfile(path)
+            except OSError as e:
+                logger.error(f"Metrics export failed: {str(e)}")
+        if records != self._exported:
+            self._exported = records
+            logger.info("metrics", extra={"metrics": records})
+        return records
+
+    def start_export(self, path, interval=30.0):
+        """Export on a background thread every interval seconds until stop_export()"""
+        self.stop_export()
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.export(path)
+            self.export(path)
+
+        self._export_stop = stop
+        self._export_thread = threading.Thread(target=run, daemon=True)
+        self._export_thread.start()
+
+    def stop_export(self):
+        """Stop the export thread after a final export"""
+        if self._export_thread is not None:
+            self._export_stop.set()
+            self._export_thread.join()
+            self._export_thread = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line, keeping span and metrics payloads"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("span", "metrics"):
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+registry = Metrics()
+span = registry.span
+observe = registry.observe
+count = registry.count
+gauge = registry.gauge
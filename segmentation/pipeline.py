@@ -0,0 +1,243 @@
+"""Streaming batch pipeline and the per-item work done in batch worker processes.
+
+The worker functions live here rather than in the GUI, so spawned workers unpickle them
+without importing tkinter.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from . import metrics
+from .features import image_features
+from .inference import (TemporalSegmenter, coarse_to_fine_labels, labels_to_binary, predict_labels,
+                        predict_probabilities)
+from .io import encode_batch_result, preprocess_frame, segmented_path
+
+
+class _PipelineError:
+    """Carries an exception from a pipeline stage to the consumer"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+_PIPELINE_END = object()
+
+
+def stream_pipeline(source, stages, queue_size=4, should_stop=None):
+    """Stream items from source through stages and yield the results in order.
+
+    The source and every stage run on their own thread, connected by bounded queues, so
+    at most queue_size items wait between any two stages and memory stays constant for
+    arbitrarily long inputs. Each stage is a function mapping an iterable of items to an
+    iterable of results. should_stop() is polled to abandon the stream early.
+    """
+    stop = threading.Event()
+
+    def stopped():
+        return stop.is_set() or (should_stop is not None and should_stop())
+
+    def put(q, item):
+        while not stopped():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def drain(q):
+        while True:
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if stopped():
+                    return
+                continue
+            if item is _PIPELINE_END:
+                return
+            if isinstance(item, _PipelineError):
+                raise item.error
+            yield item
+
+    def run(stage, q_in, q_out):
+        try:
+            items = source if q_in is None else drain(q_in)
+            for item in (items if stage is None else stage(items)):
+                if not put(q_out, item):
+                    return
+        except Exception as e:
+            put(q_out, _PipelineError(e))
+        put(q_out, _PIPELINE_END)
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = [threading.Thread(target=run, args=(None, None, queues[0]), daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(target=run, args=(stage, queues[i], queues[i + 1]), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    def queue_depths():
+        return [("pipeline_queue_depth", {"queue": str(i)}, q.qsize()) for i, q in enumerate(queues)]
+    metrics.registry.add_collector(queue_depths)
+
+    try:
+        yield from drain(queues[-1])
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        metrics.registry.remove_collector(queue_depths)
+
+
+def map_stage(function):
+    """Wrap a per-item function as a pipeline stage"""
+    return partial(map, function)
+
+
+def ordered_pool_stage(pool, function, max_pending):
+    """Pipeline stage that runs function(*item) on an executor and yields results in input order"""
+    def stage(items):
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(function, *item))
+            metrics.gauge("pool_pending", len(pending))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    return stage
+
+
+_batch_worker = {}
+
+
+def init_batch_worker(classifier, config, options):
+    """Keep the classifier and batch settings resident in each worker process"""
+    _batch_worker.update(classifier=classifier, config=config, options=options)
+
+
+def segment_batch_item(name, img):
+    """Featurize and segment one preprocessed image inside a batch worker process"""
+    classifier = _batch_worker["classifier"]
+    options = _batch_worker["options"]
+
+    # Probability and feature outputs need the full stack, so they disable coarse-to-fine
+    coarse = options["coarse_to_fine"] and not (options["save_probabilities"] or options["save_features"])
+    try:
+        if coarse:
+            labels = coarse_to_fine_labels(classifier, img, _batch_worker["config"],
+                                           tolerance=options["coarse_to_fine_tolerance"])[0]
+        else:
+            stack = image_features(img, _batch_worker["config"])
+            labels = predict_labels(classifier, stack, options["block_rows"])
+    except Exception as e:
+        return {"name": name, "error": str(e), "metrics": metrics.registry.take()}
+
+    result = {"name": name, "pixels": labels.size}
+    result["segmented"] = labels_to_binary(labels) if options["binary"] else labels
+
+    if options["save_probabilities"]:
+        result["probabilities"] = predict_probabilities(classifier, stack, options["block_rows"])
+    if options["save_features"]:
+        # Stacks are large, so workers write them directly instead of shipping them back
+        with metrics.span("write", target="features"):
+            np.save(os.path.join(options["output_folder"], f"{name}_features.npy"), stack.data)
+
+    # Spans recorded in this worker process travel back with the result
+    result["metrics"] = metrics.registry.take()
+    return result
+
+
+def segment_temporal_item(segmenter, options, name, img):
+    """Segment the next video frame with a TemporalSegmenter, in the batch result format"""
+    try:
+        labels, fraction = segmenter.segment(img)
+    except Exception as e:
+        segmenter.reset()
+        return {"name": name, "error": str(e)}
+
+    metrics.observe("recomputed_fraction", fraction)
+    segmented = labels_to_binary(labels) if options["binary"] else labels
+    return {"name": name, "pixels": labels.size, "segmented": segmented, "recomputed": fraction}
+
+
+def write_batch_result(result, options):
+    """Write an encoded segmentation, and its probabilities if requested, to the output folder"""
+    with metrics.span("write", target="segmented"):
+        with open(segmented_path(options, result["name"]), "wb") as f:
+            f.write(result["encoded"].tobytes())
+    if "probabilities" in result:
+        with metrics.span("write", target="probabilities"):
+            np.save(os.path.join(options["output_folder"], f"{result['name']}_probabilities.npy"),
+                    result["probabilities"])
+
+
+def run_batch(frames, classifier, config, options, workers=1, crop=None, should_stop=None):
+    """Stream (name, BGR array) items through preprocess -> features/predict -> encode -> write.
+
+    Items are segmented on a pool of that many spawned processes, or in order on this
+    process with a TemporalSegmenter when options["temporal"] is set, and written in input order. Yields
+    {"name", "pixels"[, "recomputed"]} for every written item and {"name", "error"} for
+    every failed one. should_stop() is polled to abandon the batch early.
+    """
+    start_time = time.time()
+    processed = 0
+    recomputed = []
+
+    try:
+        # Spawned workers avoid forking a process that is running Tk and other threads
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=init_batch_worker, initargs=(classifier, config, options)) as pool:
+            if options["temporal"]:
+                # Each frame reuses the previous frame's labels, so frames are segmented in order here
+                segmenter = TemporalSegmenter(classifier, config, options["temporal_threshold"],
+                                              block_rows=options["block_rows"], workers=workers)
+                segment_stage = map_stage(lambda item: segment_temporal_item(segmenter, options, *item))
+            else:
+                segment_stage = ordered_pool_stage(pool, segment_batch_item, 2 * workers)
+            stages = [
+                map_stage(lambda item: (item[0], preprocess_frame(item[1], crop))),
+                segment_stage,
+                map_stage(lambda result: encode_batch_result(result, options["extension"])),
+            ]
+            results = stream_pipeline(frames, stages, queue_size=2 * workers, should_stop=should_stop)
+            try:
+                for result in results:
+                    name = result["name"]
+                    if "metrics" in result:
+                        metrics.registry.merge(result.pop("metrics"))
+                    try:
+                        if "error" in result:
+                            raise ValueError(result["error"])
+                        write_batch_result(result, options)
+                        summary = {"name": name, "pixels": result["pixels"]}
+                        metrics.count("batch_items", status="done")
+                        if "recomputed" in result:
+                            summary["recomputed"] = result["recomputed"]
+                            recomputed.append(result["recomputed"])
+                            logging.info(f"{name}: recomputed {result['recomputed']:.1%} of pixels")
+                    except Exception as e:
+                        logging.error(f"Batch item {name} failed: {str(e)}")
+                        summary = {"name": name, "error": str(e)}
+                        metrics.count("batch_items", status="failed")
+                    processed += 1
+                    elapsed = time.time() - start_time
+                    metrics.gauge("batch_items_per_second", processed / elapsed if elapsed > 0 else 0.0)
+                    yield summary
+            finally:
+                results.close()
+
+            if should_stop is not None and should_stop():
+                pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        if recomputed:
+            logging.info(f"Temporal reuse: recomputed {np.mean(recomputed):.1%} of pixels per frame on average")
@@ -0,0 +1,187 @@
+"""Incremental training sets and random forest training"""
+import numpy as np
+
+from . import metrics
+
+
+class TrainingSet:
+    """Growable training buffer holding one row per labeled pixel across training images.
+
+    Each image keeps a snapshot of the labels it was last trained with and a pixel-to-row
+    map, so label edits translate into row additions and swap-removals proportional to
+    the number of changed pixels.
+
+    With max_rows_per_label set, each label keeps a reservoir sample of at most that many
+    rows drawn uniformly from every pixel painted with it across rounds and images, so
+    the training set stays class-balanced and bounded however much is painted.
+    """
+
+    def __init__(self, config, capacity=4096, max_rows_per_label=None, seed=0):
+        self.config = config
+        self.max_rows_per_label = max_rows_per_label
+        self.seen = {}
+        self._rng = np.random.default_rng(seed)
+        self.size = 0
+        self.features = None
+        self.labels = np.empty(capacity, dtype=np.uint8)
+        self.sources = np.empty(capacity, dtype=np.int32)
+        self.pixels = np.empty(capacity, dtype=np.int64)
+        self._source_keys = {}
+        self._snapshots = []
+        self._row_maps = []
+
+    def _source(self, key, shape):
+        """Return the id of a training image, registering it on first use"""
+        if key not in self._source_keys:
+            self._source_keys[key] = len(self._snapshots)
+            self._snapshots.append(np.zeros(shape, dtype=np.uint8))
+            self._row_maps.append(np.full(int(np.prod(shape)), -1, dtype=np.int64))
+        return self._source_keys[key]
+
+    def diff(self, key, label_mask):
+        """Return flat indices of pixels to add and to remove since the last commit"""
+        snapshot = self._snapshots[self._source(key, label_mask.shape)].ravel()
+        labels = label_mask.ravel()
+        changed = labels != snapshot
+        added = np.flatnonzero(changed & (labels > 0))
+        removed = np.flatnonzero(changed & (snapshot > 0))
+        return added, removed
+
+    def _reserve(self, extra, num_channels):
+        """Grow the buffers geometrically to hold extra rows"""
+        if self.features is None:
+            self.features = np.empty((len(self.labels), num_channels), dtype=np.float32)
+        needed = self.size + extra
+        if needed <= len(self.labels):
+            return
+        capacity = max(needed, 2 * len(self.labels))
+        for name in ("features", "labels", "sources", "pixels"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add(self, key, pixels, features, labels):
+        """Append rows for labeled pixels of one image"""
+        source = self._source_keys[key]
+        self._reserve(len(pixels), features.shape[1])
+        rows = np.arange(self.size, self.size + len(pixels))
+        self.features[rows] = features
+        self.labels[rows] = labels
+        self.sources[rows] = source
+        self.pixels[rows] = pixels
+        self._row_maps[source][pixels] = rows
+        self.size += len(pixels)
+
+    def sample(self, pixels, labels):
+        """Pick which newly labeled pixels enter the per-label reservoirs.
+
+        Rows displaced by accepted pixels are dropped here; returns the sorted positions in
+        pixels of the ones to featurize and add.
+        """
+        kept = []
+        evicted = []
+        for label in np.unique(labels).tolist():
+            new = np.flatnonzero(labels == label)
+            seen = self.seen.get(label, 0)
+            self.seen[label] = seen + len(new)
+            if self.max_rows_per_label is None:
+                kept.append(new)
+                continue
+
+            # Algorithm R over the stream of pixels painted with this label, in random order
+            new = self._rng.permutation(new)
+            budget = self.max_rows_per_label
+            members = np.flatnonzero(self.labels[:self.size] == label)
+            fill = max(0, min(len(new), budget - len(members)))
+            owners = np.concatenate([members, -1 - np.arange(fill)])
+
+            positions = seen + fill + 1 + np.arange(len(new) - fill)
+            winners = fill + np.flatnonzero(self._rng.random(len(positions)) < budget / positions)
+            if len(winners):
+                victims = self._rng.integers(0, len(owners), size=len(winners))
+                slots, last = np.unique(victims[::-1], return_index=True)
+                owners[slots] = -1 - winners[len(winners) - 1 - last]
+
+            evicted.append(np.setdiff1d(members, owners[owners >= 0]))
+            kept.append(new[-1 - owners[owners < 0]])
+
+        self._drop_rows(np.concatenate(evicted) if evicted else np.empty(0, dtype=np.int64))
+        return np.sort(np.concatenate(kept)) if kept else np.empty(0, dtype=np.int64)
+
+    def remove(self, key, pixels):
+        """Remove the rows for pixels of one image by moving tail rows into the holes"""
+        if len(pixels) == 0:
+            return
+        source = self._source_keys[key]
+        old_labels, counts = np.unique(self._snapshots[source].ravel()[pixels], return_counts=True)
+        for label, count in zip(old_labels.tolist(), counts.tolist()):
+            self.seen[label] = self.seen.get(label, 0) - count
+
+        doomed = self._row_maps[source][pixels]
+        self._drop_rows(doomed[doomed >= 0])
+
+    def _drop_rows(self, doomed):
+        """Swap-remove rows, keeping every image's pixel-to-row map in step"""
+        if len(doomed) == 0:
+            return
+        doomed = np.sort(doomed)
+        for source in np.unique(self.sources[doomed]):
+            self._row_maps[source][self.pixels[doomed[self.sources[doomed] == source]]] = -1
+
+        new_size = self.size - len(doomed)
+        holes = doomed[doomed < new_size]
+        movers = np.setdiff1d(np.arange(new_size, self.size), doomed, assume_unique=True)
+        for name in ("features", "labels", "sources", "pixels"):
+            array = getattr(self, name)
+            array[holes] = array[movers]
+        for source in np.unique(self.sources[holes]):
+            moved = holes[self.sources[holes] == source]
+            self._row_maps[source][self.pixels[moved]] = moved
+        self.size = new_size
+
+    def commit(self, key, label_mask):
+        """Record the labels the current rows were built from"""
+        self._snapshots[self._source_keys[key]] = label_mask.copy()
+
+    def update(self, key, label_mask, featurize):
+        """Apply one image's label edits since the last update.
+
+        New pixels go through the per-label reservoirs first, and featurize(region) is
+        called once for the (y0, y1, x0, x1) bounding box of the ones sampled in. Returns
+        False when the labels are unchanged.
+        """
+        added, removed = self.diff(key, label_mask)
+        if added.size == 0 and removed.size == 0:
+            return False
+
+        self.remove(key, removed)
+        if added.size:
+            added = added[self.sample(added, label_mask.flat[added])]
+        if added.size:
+            rows, cols = np.unravel_index(added, label_mask.shape)
+            y0, x0 = rows.min(), cols.min()
+            stack = featurize((y0, rows.max() + 1, x0, cols.max() + 1))
+            self.add(key, added, stack.data[rows - y0, cols - x0], label_mask.flat[added])
+        self.commit(key, label_mask)
+        return True
+
+    def select_channels(self, config, columns):
+        """Keep only the given feature columns and rebind the set to the pruned config"""
+        if self.features is not None:
+            self.features = np.ascontiguousarray(self.features[:, columns])
+        self.config = config
+
+
+def make_classifier(n_estimators=100, random_state=42):
+    """Return an unfitted random forest, importing scikit-learn on first use"""
+    from sklearn.ensemble import RandomForestClassifier
+    return RandomForestClassifier(n_estimators=n_estimators, random_state=random_state)
+
+
+def train_forest(features, labels, n_estimators=100, random_state=42):
+    """Fit a random forest on (N, C) feature rows and their labels"""
+    classifier = make_classifier(n_estimators, random_state)
+    with metrics.span("train"):
+        classifier.fit(features, labels)
+    return classifier
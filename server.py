@@ -0,0 +1,590 @@
+"""Headless HTTP backend implementing the /api/* contract used by backend-integration.js.
+
+Run it with `python server.py --port 5000` and point the web client at it with
+`new BackendIntegration("http://127.0.0.1:5000")`. An asyncio loop reads requests,
+and decoding, feature extraction, training and prediction run on a worker thread pool
+(numpy, scipy and the forest release the GIL), so the loop stays responsive while
+models train. Each client gets its own session, chosen with the X-Session-Id header,
+a ?session= query or a "session" body field, holding its classifier and training rows.
+
+Uploaded images and their feature stacks are kept in a memory-budgeted LRU under a
+session and content key. Responses carry an "image_key"; later calls may send it in
+place of the image, so iterating train -> segment on one image decodes and featurizes
+it once. Cache hit, miss and eviction counts are reported by /api/health.
+
+Requests may also be sent as binary envelopes (see transport.py) carrying raw or
+compressed images and RLE or bit-packed label masks. Results come back as envelopes
+when the request was one or its Accept header names the envelope type, otherwise as
+JSON with base64 PNGs.
+
+Video calls accept "temporal": true to reuse labels between consecutive frames and
+recompute only regions whose pixels changed by more than "change_threshold" gray levels
+(default 8). process_video_frame keeps that state per session, process_video_batch per
+call; results then report the "recomputed_fraction" of each frame.
+
+GET /api/metrics returns per-stage timings, request counts and cache hit rates in the
+Prometheus text format; --metrics-file also writes them to a file periodically and
+--json-logs switches the log to one JSON record per line.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+
+from segmentation import metrics
+from segmentation.config import FEATURE_FAMILIES, feature_config as build_feature_config
+from segmentation.features import FeatureCache, FeatureStack, image_features
+from segmentation.inference import TemporalSegmenter, labels_to_binary, predict_labels
+from segmentation.io import load_model, save_model
+from segmentation.training import TrainingSet, train_forest
+from transport import ENVELOPE_TYPE, Part, decode_envelope, decode_image_part, decode_mask_part, encode_envelope
+
+# Feature names sent by the web client. "raw" maps to Gaussian smoothing, whose
+# smallest sigma is effectively the raw intensity.
+FEATURE_ALIASES = {
+    "raw": "Gaussian Smoothing",
+    "gaussian": "Gaussian Smoothing",
+    "sobel": "Edge",
+    "laplacian": "Laplacian of Gaussian",
+    "gradient": "Gaussian Gradient Magnitude",
+    "dog": "Difference of Gaussians",
+    "gabor": "Texture",
+    "structure-tensor": "Structure Tensor Eigenvalues",
+    "hessian": "Hessian of Gaussian Eigenvalue",
+}
+
+STATUS_TEXT = {
+    200: "OK",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+SESSION_ID = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+
+def feature_config(features, sigmas=None):
+    """Build a feature config from client feature names and sigma values"""
+    families = set()
+    for name in features or []:
+        family = FEATURE_ALIASES.get(name, name)
+        if family not in FEATURE_FAMILIES:
+            raise ValueError(f"Unknown feature: {name}")
+        families.add(family)
+    if not families:
+        raise ValueError("No features selected")
+
+    return build_feature_config(families, sigmas or None)
+
+
+def decode_image(data):
+    """Decode a base64 image, data URL or envelope Part to an RGB array"""
+    if isinstance(data, Part):
+        return decode_image_part(data)
+    if not isinstance(data, str):
+        raise ValueError("Image must be a base64 string or data URL")
+    if data.startswith("data:"):
+        data = data.partition(",")[2]
+
+    img = cv2.imdecode(np.frombuffer(base64.b64decode(data), dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def encode_png(array):
+    """Encode a single-channel array as base64 PNG, without a data URL prefix"""
+    ok, encoded = cv2.imencode(".png", array)
+    if not ok:
+        raise ValueError("Could not encode PNG")
+    return base64.b64encode(encoded).decode("ascii")
+
+
+def decode_labels(labels, shape):
+    """Turn a flat client label array or envelope Part into a uint8 label mask of the image shape"""
+    if isinstance(labels, Part):
+        return decode_mask_part(labels, shape)
+    mask = np.asarray(labels, dtype=np.int64)
+    if mask.size != shape[0] * shape[1]:
+        raise ValueError(f"Expected {shape[0] * shape[1]} labels, got {mask.size}")
+    return np.clip(mask, 0, 255).astype(np.uint8).reshape(shape)
+
+
+def to_json(value):
+    """Replace the arrays in a response with base64 PNGs"""
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_json(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return encode_png(value)
+    return value
+
+
+class ObjectCache:
+    """Thread-safe LRU of images and feature stacks sharing one memory budget"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        """Cache a value, evicting least recently used entries to stay within the budget"""
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def discard(self, predicate):
+        """Drop every entry whose key matches predicate"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def collect_metrics(self):
+        """Occupancy and hit ratio gauges for the metrics registry"""
+        stats = self.stats()
+        requests = stats["hits"] + stats["misses"]
+        labels = {"cache": "objects"}
+        return [("cache_hit_ratio", labels, stats["hits"] / requests if requests else 0.0),
+                ("cache_bytes", labels, stats["bytes"]),
+                ("cache_entries", labels, stats["entries"]),
+                ("cache_evictions", labels, stats["evictions"])]
+
+
+class Session:
+    """Per-client classifier and training rows"""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.lock = threading.Lock()
+        self.classifier = None
+        self.config = None
+        self.training_set = None
+        self.temporal = None
+        self.last_used = time.monotonic()
+
+
+class SegmentationService:
+    """Handlers for the /api/* contract; every call runs on a worker thread"""
+
+    def __init__(self, model_dir="models", max_rows_per_label=20000, block_rows=256, session_ttl=3600,
+                 cache_bytes=2 * 1024 ** 3):
+        self.model_dir = model_dir
+        self.cache = ObjectCache(cache_bytes)
+        metrics.registry.add_collector(self.cache.collect_metrics)
+        self.max_rows_per_label = max_rows_per_label
+        self.block_rows = block_rows
+        self.session_ttl = session_ttl
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self.routes = {
+            "extract_features": self.extract_features,
+            "train_classifier": self.train_classifier,
+            "segment_image": self.segment_image,
+            "process_video_frame": self.process_video_frame,
+            "process_video_batch": self.process_video_batch,
+            "save_classifier": self.save_classifier,
+            "load_classifier": self.load_classifier,
+        }
+
+    def session(self, session_id):
+        """Return the session for an id, creating it and dropping idle ones"""
+        if not SESSION_ID.fullmatch(session_id):
+            raise ValueError("Invalid session id")
+
+        now = time.monotonic()
+        with self._lock:
+            for stale in [key for key, session in self.sessions.items() if now - session.last_used > self.session_ttl]:
+                del self.sessions[stale]
+                self.cache.discard(lambda key: key[1] == stale)
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = Session(session_id)
+            session.last_used = now
+        return session
+
+    def handle(self, name, session_id, body, content_type="application/json", accept=""):
+        """Run one API call and return (status, response bytes, response content type)"""
+        envelope_request = content_type.startswith(ENVELOPE_TYPE)
+        envelope_response = envelope_request or ENVELOPE_TYPE in accept
+        request = {}
+        try:
+            with metrics.span("decode", source="request"):
+                parsed = decode_envelope(body) if envelope_request else json.loads(body) if body else {}
+            if not isinstance(parsed, dict):
+                raise ValueError("Request body must be a JSON object")
+            request = parsed
+            session = self.session(session_id or request.get("session") or "default")
+            with metrics.span("request", endpoint=name):
+                status, response = 200, self.routes[name](session, request)
+        except KeyError as e:
+            status, response = 400, {"success": False, "error": f"Missing field: {e.args[0]}"}
+        except (ValueError, TypeError) as e:
+            status, response = 400, {"success": False, "error": str(e)}
+        except Exception as e:
+            logging.error(f"{name} failed: {str(e)}")
+            status, response = 500, {"success": False, "error": str(e)}
+
+        metrics.count("requests", endpoint=name, status=status)
+        with metrics.span("encode", format="envelope" if envelope_response else "json"):
+            if envelope_response:
+                encoding = request.get("result_encoding", "png" if name == "extract_features" else "rle")
+                return status, encode_envelope(response, encoding), ENVELOPE_TYPE
+            return status, json.dumps(to_json(response)).encode(), "application/json"
+
+    def _image(self, session, request, field="image", cache=True):
+        """Return (content key, RGB image) from an uploaded image or a cached image_key"""
+        if request.get(field) is None and request.get("image_key"):
+            key = request["image_key"]
+            img = self.cache.get(("image", session.id, key))
+            if img is None:
+                raise ValueError("Unknown or evicted image_key, resend the image")
+            return key, img
+
+        with metrics.span("decode", source="image"):
+            img = decode_image(request[field])
+        key = FeatureCache.make_key(img, None)
+        if cache:
+            if not img.flags.owndata:
+                # Raw envelope images are views of the request body; cache only the pixels
+                img = img.copy()
+            self.cache.put(("image", session.id, key), img, img.nbytes)
+        return key, img
+
+    def _features(self, session, key, img, config, cache=True):
+        """Return the full-image FeatureStack for an image, computing it on a cache miss"""
+        cache_key = ("features", session.id, key, json.dumps(config, sort_keys=True))
+        stack = self.cache.get(cache_key) if cache else None
+        if stack is None:
+            stack = image_features(img, config)
+            if cache:
+                self.cache.put(cache_key, stack, stack.data.nbytes)
+        return stack
+
+    def extract_features(self, session, request):
+        key, img = self._image(session, request)
+        config = feature_config(request.get("features"), request.get("sigma_values"))
+        stack = self._features(session, key, img, config)
+
+        features = {}
+        for name in stack.channel_names:
+            channel = cv2.normalize(stack.channel(name), None, 0, 255, cv2.NORM_MINMAX)
+            features[name] = channel.astype(np.uint8)
+        return {"success": True, "image_key": key, "features": features}
+
+    def train_classifier(self, session, request):
+        key, img = self._image(session, request)
+        label_mask = decode_labels(request["labels"], img.shape[:2])
+        config = feature_config(request.get("features"), request.get("sigma_values"))
+
+        def featurize(region):
+            y0, y1, x0, x1 = region
+            stack = self._features(session, key, img, config)
+            return FeatureStack(stack.data[y0:y1, x0:x1], stack.channel_names)
+
+        with session.lock:
+            if session.training_set is None or session.training_set.config != config:
+                session.training_set = TrainingSet(config, max_rows_per_label=self.max_rows_per_label)
+            training_set = session.training_set
+
+            changed = training_set.update(key, label_mask, featurize)
+            if training_set.size == 0:
+                raise ValueError("No labeled pixels found")
+
+            if changed or session.classifier is None:
+                session.classifier = train_forest(training_set.features[:training_set.size],
+                                                  training_set.labels[:training_set.size])
+                session.config = config
+
+            return {
+                "success": True,
+                "image_key": key,
+                "retrained": changed,
+                "training_pixels": int(training_set.size),
+                "classes": session.classifier.classes_.tolist(),
+            }
+
+    def _segment(self, session, request, field="image", cache=True):
+        """Segment the request's image with the session's classifier; returns (key, labels)"""
+        with session.lock:
+            classifier, config = session.classifier, session.config
+        if classifier is None:
+            raise ValueError("Classifier not trained")
+
+        key, img = self._image(session, request, field, cache)
+        labels = predict_labels(classifier, self._features(session, key, img, config, cache), self.block_rows)
+        return key, labels_to_binary(labels) if request.get("binary_output", True) else labels
+
+    def _temporal_segmenter(self, classifier, config, request, previous=None):
+        """Return a TemporalSegmenter for the classifier, reusing previous while it still applies"""
+        threshold = float(request.get("change_threshold", 8))
+        if (previous is not None and previous.classifier is classifier and previous.config == config
+                and previous.threshold == threshold):
+            return previous
+        return TemporalSegmenter(classifier, config, threshold, block_rows=self.block_rows)
+
+    def segment_image(self, session, request):
+        key, segmented = self._segment(session, request)
+        return {"success": True, "image_key": key, "segmented_image": segmented}
+
+    def process_video_frame(self, session, request):
+        if not request.get("temporal"):
+            # Frames are rarely revisited, so they bypass the cache unless sent by key
+            key, segmented = self._segment(session, request, "frame", cache=False)
+            return {"success": True, "image_key": key, "segmented_frame": segmented}
+
+        key, img = self._image(session, request, "frame", cache=False)
+        # The session lock keeps a client's frames in order against its previous-frame state
+        with session.lock:
+            if session.classifier is None:
+                raise ValueError("Classifier not trained")
+            session.temporal = self._temporal_segmenter(session.classifier, session.config, request, session.temporal)
+            labels, fraction = session.temporal.segment(img)
+
+        segmented = labels_to_binary(labels) if request.get("binary_output", True) else labels
+        return {"success": True, "image_key": key, "segmented_frame": segmented, "recomputed_fraction": fraction}
+
+    def process_video_batch(self, session, request):
+        binary_output = request.get("binary_output", True)
+        segmenter = None
+        if request.get("temporal"):
+            with session.lock:
+                classifier, config = session.classifier, session.config
+            if classifier is None:
+                raise ValueError("Classifier not trained")
+            segmenter = self._temporal_segmenter(classifier, config, request)
+
+        results = []
+        for index, frame in enumerate(request["frames"]):
+            name = frame.get("name", f"frame_{index:04d}.png")
+            result = {"original_name": name, "timestamp": frame.get("timestamp"), "frame_index": index}
+            try:
+                if segmenter is None:
+                    _, segmented = self._segment(session, dict(frame, binary_output=binary_output), cache=False)
+                else:
+                    labels, fraction = segmenter.segment(self._image(session, frame, cache=False)[1])
+                    segmented = labels_to_binary(labels) if binary_output else labels
+                    result["recomputed_fraction"] = fraction
+                result.update(success=True, segmented_name=f"{os.path.splitext(name)[0]}_segmented.png",
+                              segmented_image=segmented)
+            except Exception as e:
+                if segmenter is not None:
+                    segmenter.reset()
+                result.update(success=False, error=str(e))
+            results.append(result)
+
+        return {"success": True, "results": results,
+                "processed": sum(result["success"] for result in results)}
+
+    def _model_path(self, session, request):
+        name = request.get("name", session.id)
+        if not SESSION_ID.fullmatch(name):
+            raise ValueError("Invalid model name")
+        return os.path.join(self.model_dir, f"{name}.pkl")
+
+    def save_classifier(self, session, request):
+        with session.lock:
+            classifier, config = session.classifier, session.config
+        if classifier is None:
+            raise ValueError("Classifier not trained")
+
+        path = self._model_path(session, request)
+        save_model(path, classifier, config)
+        return {"success": True, "path": path}
+
+    def load_classifier(self, session, request):
+        path = self._model_path(session, request)
+        if not os.path.exists(path):
+            raise ValueError("No saved classifier")
+
+        classifier, config = load_model(path)
+        with session.lock:
+            session.classifier = classifier
+            session.config = config
+            session.training_set = None
+        return {"success": True, "path": path, "classes": classifier.classes_.tolist()}
+
+
+class _HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class BackendServer:
+    """Minimal HTTP/1.1 server dispatching /api/* calls to a SegmentationService"""
+
+    def __init__(self, service, host="127.0.0.1", port=5000, workers=None, max_body_bytes=512 * 1024 ** 2):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.max_body_bytes = max_body_bytes
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logging.info(f"Serving on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    status, payload, content_type = await self._dispatch(method, target, headers, body)
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                except _HttpError as e:
+                    status, payload = e.status, json.dumps({"success": False, "error": str(e)}).encode()
+                    content_type = "application/json"
+                    keep_alive = False
+
+                self._write_response(writer, status, payload, content_type, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """Read one request; returns None when the client closed the connection"""
+        try:
+            line = await reader.readline()
+            if not line.strip():
+                return None
+            parts = line.decode("latin-1").split()
+            if len(parts) != 3:
+                raise _HttpError(400, "Malformed request line")
+            method, target, _ = parts
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+        except ValueError:
+            raise _HttpError(400, "Request line or headers too long")
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise _HttpError(400, "Chunked request bodies are not supported")
+        length = int(headers.get("content-length", 0) or 0)
+        if length > self.max_body_bytes:
+            raise _HttpError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    async def _dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        if method == "OPTIONS":
+            return 204, b"", "application/json"
+        if url.path == "/api/health":
+            health = {"success": True, "sessions": len(self.service.sessions), "cache": self.service.cache.stats()}
+            return 200, json.dumps(health).encode(), "application/json"
+        if url.path == "/api/metrics":
+            return 200, metrics.registry.prometheus_text().encode(), "text/plain; version=0.0.4"
+
+        name = url.path[len("/api/"):] if url.path.startswith("/api/") else None
+        if name not in self.service.routes:
+            raise _HttpError(404, f"Unknown endpoint: {url.path}")
+        if method != "POST":
+            raise _HttpError(405, "Use POST")
+
+        session_id = headers.get("x-session-id") or parse_qs(url.query).get("session", [None])[0]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, self.service.handle, name, session_id, body,
+                                          headers.get("content-type", "application/json"),
+                                          headers.get("accept", ""))
+
+    def _write_response(self, writer, status, payload, content_type, keep_alive):
+        head = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(payload)}",
+            "Access-Control-Allow-Origin: *",
+            "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+            "Access-Control-Allow-Headers: Content-Type, X-Session-Id",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        writer.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local cell segmentation backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--model-dir", default="models")
+    parser.add_argument("--max-rows-per-label", type=int, default=20000)
+    parser.add_argument("--cache-mb", type=int, default=2048, help="memory budget for cached images and features")
+    parser.add_argument("--metrics-file", help="write Prometheus text metrics to this file every 30 s")
+    parser.add_argument("--json-logs", action="store_true", help="log one JSON object per line")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for handler in logging.getLogger().handlers:
+        if args.json_logs:
+            handler.setFormatter(metrics.JsonFormatter())
+        else:
+            handler.addFilter(lambda record: not hasattr(record, "metrics"))
+    if args.metrics_file:
+        metrics.registry.start_export(args.metrics_file)
+    service = SegmentationService(args.model_dir, args.max_rows_per_label, cache_bytes=args.cache_mb * 1024 ** 2)
+    try:
+        asyncio.run(BackendServer(service, args.host, args.port, args.workers).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Coarse-to-fine segmentation size threshold"""
+import numpy as np
+
+from segmentation.config import feature_config
+from segmentation.features import image_features
+from segmentation.inference import coarse_to_fine_labels, predict_labels
+from segmentation.training import train_forest
+
+CONFIG = feature_config(["Gaussian Smoothing", "Laplacian of Gaussian"], [0.7, 1.6, 3.5])
+
+
+def cells(size, seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    truth = ((np.sin(yy / 9.0) * np.cos(xx / 11.0)) > 0.2).astype(np.uint8) + 1
+    gray = np.clip(60 + 120 * (truth - 1) + rng.normal(0, 10, truth.shape), 0, 255).astype(np.uint8)
+    return np.dstack([gray] * 3), truth
+
+
+def classifier_for(img, truth):
+    stack = image_features(img, CONFIG)
+    rows = np.random.default_rng(1).choice(truth.size, 2000, replace=False)
+    return train_forest(stack.pixels()[rows], truth.ravel()[rows], n_estimators=10)
+
+
+def test_small_images_fall_through_to_full_resolution():
+    img, truth = cells(128)
+    classifier = classifier_for(img, truth)
+
+    labels, report = coarse_to_fine_labels(classifier, img, CONFIG)
+    assert [level["factor"] for level in report["levels"]] == [1]
+    np.testing.assert_array_equal(labels, predict_labels(classifier, image_features(img, CONFIG)))
+
+
+def test_large_enough_images_run_coarse_to_fine():
+    img, truth = cells(512)
+    classifier = classifier_for(img, truth)
+
+    labels, report = coarse_to_fine_labels(classifier, img, CONFIG)
+    assert [level["factor"] for level in report["levels"]] == [4, 1]
+    full = predict_labels(classifier, image_features(img, CONFIG))
+    assert np.mean(labels != full) <= 0.01
@@ -0,0 +1,47 @@
+"""Batch input naming"""
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from segmentation.io import batch_source, glob_root
+
+
+def write_image(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cv2.imwrite(path, np.zeros((4, 6, 3), dtype=np.uint8))
+
+
+def test_glob_root():
+    assert glob_root(os.path.join("data", "plate1", "*.tif")) == os.path.join("data", "plate1")
+    assert glob_root(os.path.join("data", "**", "*.tif")) == "data"
+    assert glob_root("*.tif") == ""
+
+
+def test_recursive_glob_keeps_duplicate_basenames_apart(tmp_path):
+    for folder in ("a", "b", os.path.join("b", "c")):
+        write_image(str(tmp_path / folder / "img1.png"))
+
+    total, frames = batch_source("glob", str(tmp_path / "**" / "*.png"))
+    names = [name for name, _ in frames]
+    assert total == 3
+    assert names == ["a__img1", "b__c__img1", "b__img1"]
+
+
+def test_flat_glob_names_by_basename(tmp_path):
+    write_image(str(tmp_path / "img1.png"))
+    write_image(str(tmp_path / "img2.png"))
+
+    _, frames = batch_source("glob", str(tmp_path / "*.png"))
+    assert [name for name, _ in frames] == ["img1", "img2"]
+
+
+def test_colliding_names_fail_up_front(tmp_path):
+    write_image(str(tmp_path / "img1.png"))
+    write_image(str(tmp_path / "img1.tif"))
+
+    with pytest.raises(ValueError, match="img1"):
+        batch_source("folder", str(tmp_path))
+    with pytest.raises(ValueError, match="img1"):
+        batch_source("glob", str(tmp_path / "*"))
@@ -0,0 +1,107 @@
+"""TrainingSet row bookkeeping, per-label reservoirs and incremental featurization"""
+import numpy as np
+
+from segmentation.config import feature_config
+from segmentation.features import FeatureStack, image_features, region_features
+from segmentation.training import TrainingSet
+
+CONFIG = feature_config(["Gaussian Smoothing", "Laplacian of Gaussian", "Hessian of Gaussian Eigenvalue"],
+                        [0.7, 1.6])
+
+
+def pixel_ids(shape):
+    """Featurizer whose single channel is the flat pixel index, so rows can be traced back"""
+    ids = np.arange(shape[0] * shape[1], dtype=np.float32).reshape(shape)
+
+    def featurize(region):
+        y0, y1, x0, x1 = region
+        return FeatureStack(ids[y0:y1, x0:x1, None], ["id"])
+    return featurize
+
+
+def check_rows(training_set, keys, masks):
+    """Every live row maps back to its pixel and every labeled pixel with a row maps to it"""
+    size = training_set.size
+    rows = np.arange(size)
+    for key, mask in zip(keys, masks):
+        if key not in training_set._source_keys:
+            continue
+        source = training_set._source_keys[key]
+        row_map = training_set._row_maps[source]
+        mine = rows[training_set.sources[:size] == source]
+        np.testing.assert_array_equal(row_map[training_set.pixels[mine]], mine)
+        np.testing.assert_array_equal(training_set.features[mine, 0], training_set.pixels[mine])
+        np.testing.assert_array_equal(training_set.labels[mine], mask.ravel()[training_set.pixels[mine]])
+
+        mapped = np.flatnonzero(row_map >= 0)
+        assert len(mapped) == len(mine)
+        assert np.all(mask.ravel()[mapped] > 0)
+
+
+def test_row_maps_stay_consistent_after_removals():
+    rng = np.random.default_rng(1)
+    shape = (40, 50)
+    masks = [np.zeros(shape, dtype=np.uint8), np.zeros(shape, dtype=np.uint8)]
+    keys = ["a", "b"]
+    training_set = TrainingSet(CONFIG, capacity=8)
+
+    for _ in range(12):
+        for key, mask in zip(keys, masks):
+            y, x = rng.integers(0, 30), rng.integers(0, 40)
+            mask[y:y + 10, x:x + 10] = rng.integers(0, 4)  # 0 erases, others paint or relabel
+            training_set.update(key, mask, pixel_ids(shape))
+            check_rows(training_set, keys, masks)
+
+    assert training_set.size == sum(int(np.count_nonzero(mask)) for mask in masks)
+
+
+def test_reservoirs_cap_rows_per_label():
+    rng = np.random.default_rng(2)
+    shape = (60, 60)
+    cap = 100
+    masks = [np.zeros(shape, dtype=np.uint8), np.zeros(shape, dtype=np.uint8)]
+    keys = ["a", "b"]
+    training_set = TrainingSet(CONFIG, max_rows_per_label=cap)
+
+    def counts():
+        labels = training_set.labels[:training_set.size]
+        return [int(np.count_nonzero(labels == label)) for label in (1, 2)]
+
+    # Painting fresh pixels keeps each reservoir full up to the cap
+    for band in range(10):
+        for key, mask in zip(keys, masks):
+            mask[band * 6:band * 6 + 6, rng.integers(0, 20):rng.integers(30, 60)] = band % 2 + 1
+            training_set.update(key, mask, pixel_ids(shape))
+            check_rows(training_set, keys, masks)
+            painted = [sum(int(np.count_nonzero(m == label)) for m in masks) for label in (1, 2)]
+            assert [training_set.seen.get(label, 0) for label in (1, 2)] == painted
+            assert counts() == [min(cap, count) for count in painted]
+
+    # Relabeling and erasing evicts rows without breaking the cap or the row maps
+    for _ in range(10):
+        for key, mask in zip(keys, masks):
+            y, x = rng.integers(0, 45), rng.integers(0, 45)
+            mask[y:y + 15, x:x + 15] = rng.integers(0, 3)
+            training_set.update(key, mask, pixel_ids(shape))
+            check_rows(training_set, keys, masks)
+            assert all(count <= cap for count in counts())
+
+
+def test_update_matches_full_image_features():
+    rng = np.random.default_rng(3)
+    yy, xx = np.mgrid[:48, :64]
+    gray = 100 + 80 * np.sin(yy / 5.0) * np.cos(xx / 7.0) + rng.normal(0, 5, yy.shape)
+    img = np.clip(np.dstack([gray, gray * 0.8, gray * 0.6]), 0, 255).astype(np.uint8)
+    full = image_features(img, CONFIG)
+
+    mask = np.zeros(img.shape[:2], dtype=np.uint8)
+    training_set = TrainingSet(CONFIG)
+    for label, (y0, y1, x0, x1) in enumerate([(2, 10, 3, 20), (30, 46, 40, 62), (20, 28, 0, 64)], start=1):
+        mask[y0:y1, x0:x1] = label
+        assert training_set.update("img", mask, lambda region: region_features(img, CONFIG, region))
+    assert not training_set.update("img", mask, lambda region: region_features(img, CONFIG, region))
+
+    size = training_set.size
+    rows, cols = np.unravel_index(training_set.pixels[:size], mask.shape)
+    np.testing.assert_allclose(training_set.features[:size], full.data[rows, cols], rtol=1e-5, atol=1e-4)
+    np.testing.assert_array_equal(training_set.labels[:size], mask[rows, cols])
@@ -0,0 +1,70 @@
+"""Round trips for the envelope mask encodings"""
+import zlib
+
+import numpy as np
+import pytest
+
+from transport import (Part, decode_image_part, decode_mask_part, make_part, pack_bits, rle_decode, rle_encode,
+                       unpack_bits)
+
+MASKS = {
+    "odd_width": np.random.default_rng(0).integers(0, 4, size=(7, 13)).astype(np.uint8),
+    "all_zero": np.zeros((5, 9), dtype=np.uint8),
+    "all_one": np.ones((6, 11), dtype=np.uint8),
+    "single_pixel": np.full((1, 1), 3, dtype=np.uint8),
+    "stripes": np.repeat(np.array([[0, 0, 2, 2, 2, 1, 0]], dtype=np.uint8), 3, axis=0),
+}
+
+
+@pytest.mark.parametrize("name", MASKS)
+def test_rle_round_trip(name):
+    mask = MASKS[name]
+    decoded = rle_decode(rle_encode(mask), mask.size)
+    np.testing.assert_array_equal(decoded.reshape(mask.shape), mask)
+
+
+def test_rle_single_run():
+    mask = np.full((4, 5), 2, dtype=np.uint8)
+    data = rle_encode(mask)
+    assert len(data) == 4 + 5
+    np.testing.assert_array_equal(rle_decode(data, mask.size), mask.ravel())
+
+
+def test_rle_rejects_wrong_size():
+    with pytest.raises(ValueError):
+        rle_decode(rle_encode(MASKS["odd_width"]), MASKS["odd_width"].size + 1)
+
+
+@pytest.mark.parametrize("bits", [1, 2, 4, 8])
+@pytest.mark.parametrize("name", MASKS)
+def test_pack_bits_round_trip(name, bits):
+    mask = MASKS[name] if bits == 8 else MASKS[name] % (1 << bits)
+    data = pack_bits(mask, bits)
+    assert len(data) == -(-mask.size * bits // 8)
+    np.testing.assert_array_equal(unpack_bits(data, bits, mask.size).reshape(mask.shape), mask)
+
+
+def test_unpack_bits_rejects_short_data():
+    with pytest.raises(ValueError):
+        unpack_bits(pack_bits(MASKS["odd_width"] % 2, 1), 1, MASKS["odd_width"].size + 8)
+
+
+def test_deflate_round_trip():
+    mask = MASKS["odd_width"]
+    np.testing.assert_array_equal(decode_mask_part(make_part(mask, "deflate"), mask.shape), mask)
+    img = np.random.default_rng(1).integers(0, 256, size=(5, 7, 3)).astype(np.uint8)
+    np.testing.assert_array_equal(decode_image_part(make_part(img, "deflate")), img)
+
+
+def test_deflate_refuses_to_inflate_past_the_shape():
+    bomb = zlib.compress(bytes(64 * 1024 ** 2), 9)
+    with pytest.raises(ValueError):
+        decode_mask_part(Part(bomb, "deflate", (4, 4)), (4, 4))
+    with pytest.raises(ValueError):
+        decode_image_part(Part(bomb, "deflate", (4, 4, 3)))
+
+
+def test_deflate_rejects_truncated_data():
+    data = zlib.compress(bytes(range(256)) * 4)
+    with pytest.raises(ValueError):
+        decode_mask_part(Part(data[:-6], "deflate", (32, 32)), (32, 32))
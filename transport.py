@@ -0,0 +1,234 @@
+"""Binary envelope for the backend API.
+
+JSON requests carry images as base64 PNG data URLs and label masks as JSON number arrays.
+An envelope (Content-Type application/x-segmentation-envelope) instead carries them as
+binary parts after a small JSON header:
+
+    b"CSEG" | uint32 header length | header JSON | part bytes ...
+
+The header is the usual request or response object, where any value may be a
+{"$part": i} reference to header["parts"][i] = {"offset", "length", "encoding", "shape"}
+with offsets relative to the first part byte. Part encodings:
+
+    raw      uint8 pixels, shape (h, w) or (h, w, channels) in RGB(A) order
+    png/jpeg compressed image bytes, decoded with OpenCV
+    deflate  zlib-compressed raw pixels
+    rle      uint32 run count n, n uint32 run lengths, n uint8 run values
+    packed   labels at "bits" (1, 2 or 4) bits per pixel, least significant bits first
+
+All integers are little-endian. Parts are decoded with np.frombuffer views over the
+request body, so raw images and masks are not copied before use; the server copies a raw
+image only when it keeps it in its session cache.
+"""
+import json
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+ENVELOPE_TYPE = "application/x-segmentation-envelope"
+MAGIC = b"CSEG"
+
+
+class Part:
+    """A binary part of a decoded envelope, still in its wire encoding"""
+
+    def __init__(self, data, encoding="raw", shape=None, bits=8):
+        self.data = data
+        self.encoding = encoding
+        self.shape = tuple(shape) if shape is not None else None
+        self.bits = bits
+
+
+def _resolve(value, parts, payload):
+    if isinstance(value, dict):
+        if set(value) == {"$part"}:
+            spec = parts[value["$part"]]
+            start, length = int(spec["offset"]), int(spec["length"])
+            if start < 0 or start + length > len(payload):
+                raise ValueError("Envelope part out of range")
+            return Part(payload[start:start + length], spec.get("encoding", "raw"), spec.get("shape"),
+                        spec.get("bits", 8))
+        return {key: _resolve(item, parts, payload) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve(item, parts, payload) for item in value]
+    return value
+
+
+def decode_envelope(body):
+    """Parse an envelope into its header object, with part references replaced by Parts"""
+    view = memoryview(body)
+    if len(view) < 8 or bytes(view[:4]) != MAGIC:
+        raise ValueError("Not a segmentation envelope")
+    header_length = struct.unpack_from("<I", view, 4)[0]
+    if 8 + header_length > len(view):
+        raise ValueError("Truncated envelope header")
+
+    header = json.loads(bytes(view[8:8 + header_length]))
+    if not isinstance(header, dict):
+        raise ValueError("Envelope header must be a JSON object")
+    parts = header.pop("parts", [])
+    return _resolve(header, parts, view[8 + header_length:])
+
+
+def encode_envelope(message, encoding="rle"):
+    """Serialize an object, sending every Part and numpy array in it as a binary part.
+
+    Parts are sent as already encoded. Two-dimensional arrays are treated as label images
+    and encoded with encoding ("rle", "packed", "png", ...); other arrays go out raw.
+    Returns the envelope bytes.
+    """
+    parts = []
+    chunks = []
+    offset = 0
+
+    def collect(value):
+        nonlocal offset
+        if isinstance(value, dict):
+            return {key: collect(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [collect(item) for item in value]
+        if isinstance(value, (Part, np.ndarray)):
+            part = value if isinstance(value, Part) else make_part(value, encoding if value.ndim == 2 else "raw")
+            data = part.data
+            spec = {"encoding": part.encoding, "shape": list(part.shape), "offset": offset, "length": len(data)}
+            if part.encoding == "packed":
+                spec["bits"] = part.bits
+            parts.append(spec)
+            chunks.append(data)
+            offset += len(data)
+            return {"$part": len(parts) - 1}
+        return value
+
+    header = collect(message)
+    header["parts"] = parts
+    header = json.dumps(header).encode()
+    return b"".join([MAGIC, struct.pack("<I", len(header)), header] + chunks)
+
+
+def make_part(array, encoding="raw", bits=None):
+    """Encode a uint8 image or label array into a Part"""
+    array = np.ascontiguousarray(array, dtype=np.uint8)
+
+    if encoding == "raw":
+        return Part(array.tobytes(), encoding, array.shape)
+    if encoding == "deflate":
+        return Part(zlib.compress(array.tobytes(), 1), encoding, array.shape)
+    if encoding in ("png", "jpeg"):
+        if array.ndim == 3 and array.shape[2] == 3:
+            array = cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
+        elif array.ndim == 3 and array.shape[2] == 4:
+            array = cv2.cvtColor(array, cv2.COLOR_RGBA2BGRA)
+        ok, encoded = cv2.imencode(".png" if encoding == "png" else ".jpg", array)
+        if not ok:
+            raise ValueError(f"Could not encode {encoding}")
+        return Part(encoded.tobytes(), encoding, array.shape)
+    if encoding == "rle":
+        return Part(rle_encode(array), encoding, array.shape)
+    if encoding == "packed":
+        bits = bits or min(b for b in (1, 2, 4, 8) if int(array.max(initial=0)) < 1 << b)
+        return Part(pack_bits(array, bits), encoding, array.shape, bits)
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def rle_encode(mask):
+    """Run-length encode a uint8 mask in raster order"""
+    flat = np.ascontiguousarray(mask, dtype=np.uint8).ravel()
+    starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1]) if flat.size else np.empty(0, int)
+    lengths = np.diff(np.append(starts, flat.size)).astype("<u4")
+    return struct.pack("<I", len(starts)) + lengths.tobytes() + flat[starts].tobytes()
+
+
+def rle_decode(data, size):
+    """Expand a run-length encoded mask to a flat uint8 array of the given size"""
+    count = struct.unpack_from("<I", data, 0)[0]
+    if len(data) != 4 + 5 * count:
+        raise ValueError("Malformed RLE mask")
+    lengths = np.frombuffer(data, dtype="<u4", count=count, offset=4)
+    values = np.frombuffer(data, dtype=np.uint8, count=count, offset=4 + 4 * count)
+    if int(lengths.sum(dtype=np.int64)) != size:
+        raise ValueError("RLE mask does not match the image size")
+    return np.repeat(values, lengths)
+
+
+def pack_bits(mask, bits):
+    """Pack uint8 labels below 2**bits into bytes, least significant bits first"""
+    per_byte = 8 // bits
+    flat = np.ascontiguousarray(mask, dtype=np.uint8).ravel()
+    if bits == 8:
+        return flat.tobytes()
+    padded = np.zeros(-(-flat.size // per_byte) * per_byte, dtype=np.uint8)
+    padded[:flat.size] = flat
+    shifts = (np.arange(per_byte) * bits).astype(np.uint8)
+    return np.bitwise_or.reduce(padded.reshape(-1, per_byte) << shifts, axis=1).astype(np.uint8).tobytes()
+
+
+def unpack_bits(data, bits, size):
+    """Unpack labels stored at bits per pixel to a flat uint8 array of the given size"""
+    packed = np.frombuffer(data, dtype=np.uint8)
+    if bits == 8:
+        unpacked = packed
+    elif bits in (1, 2, 4):
+        shifts = (np.arange(8 // bits) * bits).astype(np.uint8)
+        unpacked = ((packed[:, None] >> shifts) & ((1 << bits) - 1)).ravel()
+    else:
+        raise ValueError(f"Unsupported bit depth: {bits}")
+    if unpacked.size < size:
+        raise ValueError("Packed mask does not match the image size")
+    return unpacked[:size]
+
+
+def inflate(data, size):
+    """Inflate deflate data that must expand to exactly size bytes, never producing more than size + 1"""
+    if size < 0:
+        raise ValueError("Negative decoded size")
+    inflater = zlib.decompressobj()
+    inflated = inflater.decompress(data, size + 1)
+    if len(inflated) != size or not inflater.eof:
+        raise ValueError("Deflated bytes do not match the declared size")
+    return inflated
+
+
+def decode_image_part(part):
+    """Decode an image Part to an RGB uint8 array"""
+    if part.encoding in ("png", "jpeg"):
+        img = cv2.imdecode(np.frombuffer(part.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Could not decode image")
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    if part.shape is None or len(part.shape) not in (2, 3):
+        raise ValueError("Raw images need a (height, width[, channels]) shape")
+    if part.encoding not in ("raw", "deflate"):
+        raise ValueError(f"Unknown image encoding: {part.encoding}")
+    size = int(np.prod(part.shape))
+    data = inflate(part.data, size) if part.encoding == "deflate" else part.data
+    if len(data) != size:
+        raise ValueError("Image bytes do not match the shape")
+
+    img = np.frombuffer(data, dtype=np.uint8).reshape(part.shape)
+    if img.ndim == 2 or img.shape[2] == 1:
+        return cv2.cvtColor(img.reshape(img.shape[:2]), cv2.COLOR_GRAY2RGB)
+    if img.shape[2] == 4:
+        return cv2.cvtColor(img, cv2.COLOR_RGBA2RGB)
+    if img.shape[2] != 3:
+        raise ValueError("Images must have 1, 3 or 4 channels")
+    return img
+
+
+def decode_mask_part(part, shape):
+    """Decode a label mask Part to a uint8 array of the image shape"""
+    size = shape[0] * shape[1]
+    if part.encoding == "rle":
+        flat = rle_decode(part.data, size)
+    elif part.encoding == "packed":
+        flat = unpack_bits(part.data, part.bits, size)
+    elif part.encoding in ("raw", "deflate"):
+        data = inflate(part.data, size) if part.encoding == "deflate" else part.data
+        flat = np.frombuffer(data, dtype=np.uint8)
+        if flat.size != size:
+            raise ValueError("Mask bytes do not match the image size")
+    else:
+        raise ValueError(f"Unknown mask encoding: {part.encoding}")
+    return flat.reshape(shape)